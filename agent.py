@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import asyncio
+import logging
+
+from multiprocessing import cpu_count
+from pathlib import Path
+from sys import exit
+
+from portfolio.configurations import detect_configurations, select
+from portfolio.remote import serve
+from portfolio.workspace import default_root, Workspace
+
+
+SELF_PATH = Path(__file__).resolve().parent
+TEMP_PATH = SELF_PATH.joinpath('tmp')
+
+
+def main(args):
+    logger = args.logging.getLogger('agent')
+    logger.setLevel(args.logging.getLevelName(args.log_level))
+
+    engines = list(args.configurations)
+    if args.enable_engine:
+        engines = [engine for engine in engines if any(select(pattern, [engine]) for pattern in args.enable_engine)]
+    args.engines = engines
+    if len(engines) < 1:
+        logger.critical(f'No engines are enabled! Quitting portfolio agent.')
+        exit(1)
+
+    logger.info(f'Serving {len(engines)} engine(s) on {args.jobs} CPU(s) at "{args.address}".')
+    logger.debug(f'Using workspace "{args.workspace.path}".')
+    asyncio.run(serve(args, logger))
+
+
+if __name__ == '__main__':
+    def dir_path(string):
+        path = Path(string).resolve()
+        if path.is_dir():
+            return path
+        else:
+            raise NotADirectoryError(string)
+
+    from argparse import ArgumentParser
+
+    logging.basicConfig(
+        format='%(asctime)s [%(levelname)8s] %(name)12s - %(message)s',
+        level=logging.CRITICAL)
+    logger = logging.getLogger('boot')
+
+    logger.debug(f'Booting portfolio agent at "{SELF_PATH}".')
+
+    engines_path = SELF_PATH.joinpath('engines')
+    if not engines_path.is_dir():
+        logger.critical(f'Engines directory "{engines_path}" does not exist!')
+        exit(1)
+
+    engines = [e.name for e in engines_path.glob('*')
+               if e.is_dir() and e.name != '__pycache__' ]
+    logger.debug(f'Detected engines: {engines}.')
+
+    configurations = detect_configurations(engines, logger)
+
+    parser = ArgumentParser(
+        description='Runs the engines of a portfolio solver started with --node ADDRESS on another machine')
+    parser.add_argument('-l', '--log-level',
+                        type=str.upper, default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set the logging level (default: %(default)s)')
+    parser.add_argument('-e', '--enable-engine',
+                        action='append', metavar='ENGINE[/CONFIGURATION]',
+                        help='Serve only the given CHC solver engine configurations, or patterns of them (default: all)')
+    parser.add_argument('-j', '--jobs',
+                        type=int, default=cpu_count(),
+                        help='Number of engines to run simultaneously (default: %(default)s)')
+    parser.add_argument('-g', '--grace-period',
+                        type=float, default=1.0,
+                        help='Seconds to wait for a cancelled engine before killing it (default: %(default)s)')
+    parser.add_argument('--workspace',
+                        type=dir_path, metavar='DIR',
+                        help='Directory for received inputs (default: /dev/shm if large enough, else ./tmp)')
+    parser.add_argument('--workspace-limit',
+                        type=int, default=1024, metavar='MB',
+                        help='Maximum size of the received inputs kept for reuse (default: %(default)s)')
+    parser.add_argument('address',
+                        help='Address to listen on: [HOST:]PORT or unix:PATH')
+
+    args = parser.parse_args()
+
+    args.logging = logging
+    args.workspace = Workspace(args.workspace or default_root(TEMP_PATH), args.workspace_limit * 2**20)
+    args.temp_path = args.workspace.path
+
+    args.engines_path = engines_path
+    args.engines = engines
+    args.configurations = configurations
+
+    # The agent stops its engines on SIGTERM and SIGINT, before the workspace is removed
+    try:
+        main(args)
+    finally:
+        args.workspace.close()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import sys
+
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from portfolio.bitvec import rewrite
+from portfolio.sexp import parse, serialize
+
+
+def generate_chc(width, clauses):
+    bv = f'(_ BitVec {width})'
+    lines = ['(set-logic HORN)', f'(declare-fun inv ({bv} {bv}) Bool)',
+             f'(assert (forall ((x {bv}) (y {bv})) (=> (and (= x (_ bv0 {width})) (= y (_ bv1 {width}))) (inv x y))))']
+    for c in range(clauses):
+        lines.append(f'(assert (forall ((x {bv}) (y {bv}))'
+                     f' (=> (and (inv x y) (bvult x (_ bv{c + 10} {width})))'
+                     f' (inv (bvadd x (_ bv{c + 1} {width})) (bvmul y (bvsub x (_ bv{c} {width})))))))')
+    lines.append(f'(assert (forall ((x {bv}) (y {bv})) (=> (and (inv x y) (bvslt y (_ bv0 {width}))) false)))')
+    lines.append('(check-sat)')
+    return '\n'.join(lines)
+
+def legacy_functions(width):
+    # The helpers emitted for every width before the mod/div-based encodings, restricted
+    # to the operations of the synthetic input, where multiplication nests bound_int once per bit
+    return f"""
+(define-fun SIGNED_INT_MAX_{width} () Int {(2 ** (width - 1)) - 1})
+(define-fun UNSIGNED_INT_MAX_{width} () Int {(2 ** width) - 1})
+(define-fun is_int_{width} ((x Int)) Bool
+  (and (<= 0 x) (<= x UNSIGNED_INT_MAX_{width})))
+(define-fun lbound_int_{width} ((x Int)) Int
+  (ite (< x 0) (+ x (+ 1 UNSIGNED_INT_MAX_{width})) x))
+(define-fun ubound_int_{width} ((x Int)) Int
+  (ite (> x UNSIGNED_INT_MAX_{width}) (- x (+ 1 UNSIGNED_INT_MAX_{width})) x))
+(define-fun bound_int_{width} ((x Int)) Int
+  (ubound_int_{width} (lbound_int_{width} x)))
+(define-fun bv_ult_{width} ((x Int) (y Int)) Bool
+  (let ((x (bound_int_{width} x)) (y (bound_int_{width} y))) (< x y)))
+(define-fun bv_same_sign_{width} ((x Int) (y Int)) Bool
+  (let ((x (bound_int_{width} x)) (y (bound_int_{width} y)))
+       (or (and (<= x SIGNED_INT_MAX_{width}) (<= y SIGNED_INT_MAX_{width}))
+           (and (> x SIGNED_INT_MAX_{width}) (> y SIGNED_INT_MAX_{width})))))
+(define-fun bv_slt_{width} ((x Int) (y Int)) Bool
+  (let ((x (bound_int_{width} x)) (y (bound_int_{width} y)))
+       (or (and (> x SIGNED_INT_MAX_{width}) (<= y SIGNED_INT_MAX_{width}))
+           (and (bv_same_sign_{width} x y) (bv_ult_{width} x y)))))
+(define-fun bv_add_{width} ((x Int) (y Int)) Int
+  (let ((x (bound_int_{width} x)) (y (bound_int_{width} y))) (bound_int_{width} (+ x y))))
+(define-fun bv_sub_{width} ((x Int) (y Int)) Int
+  (let ((x (bound_int_{width} x)) (y (bound_int_{width} y))) (bound_int_{width} (- x y))))
+(define-fun bv_mul_{width} ((x Int) (y Int)) Int
+  (let ((x (bound_int_{width} x)) (y (bound_int_{width} y)))
+       {f'(bound_int_{width} ' * width} (* x y) {')' * width}))
+"""
+
+def expanded_size(term, functions, env):
+    # Number of nodes once every defined function and let-binding is substituted,
+    # which is the formula a solver ends up with if it inlines the definitions
+    if type(term) is not list:
+        if term in env:
+            return env[term]
+        if term in functions and not functions[term][0]:
+            return expanded_size(functions[term][1], functions, dict())
+        return 1
+    if term[0] == 'let':
+        inner = dict(env)
+        inner.update((name, expanded_size(value, functions, env)) for name, value in term[1])
+        return expanded_size(term[2], functions, inner)
+    if term[0] in ('forall', 'exists'):
+        inner = dict(env)
+        inner.update((name, 1) for name, _ in term[1])
+        return 1 + expanded_size(term[2], functions, inner)
+
+    sizes = [expanded_size(arg, functions, env) for arg in term[1:]]
+    if type(term[0]) is str and term[0] in functions:
+        parameters, body = functions[term[0]]
+        return expanded_size(body, functions, dict(zip(parameters, sizes)))
+    return 1 + sum(sizes)
+
+def measure(commands):
+    functions, text, size = dict(), 0, 0
+    for statement in commands:
+        text += len(serialize(statement)) + 1
+        if statement[0] == 'define-fun':
+            functions[statement[1]] = ([name for name, _ in statement[2]], statement[4])
+        elif statement[0] == 'assert':
+            size += expanded_size(statement[1], functions, dict())
+    return text, size
+
+def main(args):
+    print(f'{"width":>6} {"encoding":10} {"size (KB)":>10} {"expanded nodes":>16}')
+    for width in args.width:
+        lowered = list(rewrite(parse(generate_chc(width, args.clauses))))
+        legacy = ([lowered[0]] + parse(legacy_functions(width)) +
+                  [statement for statement in lowered[1:] if statement[0] != 'define-fun'])
+
+        for name, commands in (('legacy', legacy), ('mod/div', lowered)):
+            text, size = measure(commands)
+            print(f'{width:6} {name:10} {text / 1024:10.1f} {size:16.3g}')
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-w', '--width', type=int, nargs='+', default=[8, 32, 64],
+                        help='BitVec widths of the synthetic inputs')
+    parser.add_argument('-c', '--clauses', type=int, default=20,
+                        help='Number of loop clauses in each synthetic input')
+
+    main(parser.parse_args())
@@ -0,0 +1,7 @@
+(set-logic HORN)
+(declare-fun inv ((_ BitVec 8)) Bool)
+(assert (forall ((x (_ BitVec 8))) (=> (= x #x00) (inv x))))
+(assert (forall ((x (_ BitVec 8)) (y (_ BitVec 8)))
+  (=> (and (inv x) (bvult x #x0a) (= y (bvadd x #x01))) (inv y))))
+(assert (forall ((x (_ BitVec 8))) (=> (and (inv x) (bvugt x #x0a)) false)))
+(check-sat)
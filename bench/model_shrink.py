@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import sys
+import tracemalloc
+
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser, Namespace
+from importlib import import_module
+from io import BytesIO
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from portfolio.sexp import parse, serialize
+
+
+def generate_model(predicates, helpers, size):
+    lines = ['(']
+    for p in range(predicates + helpers):
+        name = f'|inv {p}|' if p < predicates else f'aux!{p}'
+        body = 'true'
+        for i in range(size):
+            body = f'(and (or (not (<= x!0 {i})) (>= x!1 {i})) {body})'
+        lines.append(f'  (define-fun {name} ((x!0 Int) (x!1 Int)) Bool\n    {body})')
+    lines.append(')')
+    return '\n'.join(lines).encode('utf-8')
+
+def parsed_shrink(output, tracked_symbols):
+    # The shrinker before streaming: the whole model is parsed, then filtered through a list
+    result = []
+    for stmt in parse(output.decode('utf-8'))[0]:
+        if stmt[0] == 'define-fun':
+            name = stmt[1] if stmt[1].startswith('|') else f'|{stmt[1]}|'
+            if name in tracked_symbols:
+                result.append(stmt)
+    return '\n'.join(serialize(stmt) for stmt in result)
+
+def measure(shrink, output, repeat):
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        shrink(output)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    shrink(output)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+def main(args):
+    runner = import_module('engines.z3-spacer.runner')
+    runner.setup(Namespace(logging=__import__('logging'), log_level='CRITICAL'))
+
+    output = generate_model(args.predicates, args.helpers, args.size)
+    tracked = [f'|inv {p}|' for p in range(args.predicates)]
+
+    shrinkers = [
+        ('parsed', lambda output: parsed_shrink(output, tracked)),
+        ('streamed', lambda output: runner.shrink(BytesIO(output), set(tracked))),
+    ]
+
+    print(f'{"shrinker":12} {"size (KB)":>10} {"time (s)":>10} {"peak (MB)":>10}')
+    for name, shrink in shrinkers:
+        elapsed, peak = measure(shrink, output, args.repeat)
+        print(f'{name:12} {len(output) / 1024:10.1f} {elapsed:10.3f} {peak / 2**20:10.1f}')
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-p', '--predicates', type=int, default=2000,
+                        help='Number of tracked predicates in the synthetic model')
+    parser.add_argument('-a', '--helpers', type=int, default=2000,
+                        help='Number of untracked auxiliary definitions in the synthetic model')
+    parser.add_argument('-s', '--size', type=int, default=20,
+                        help='Number of conjuncts in each interpretation')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Number of timed runs per shrinker (the best one is reported)')
+
+    main(parser.parse_args())
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+import sys
+
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser, Namespace
+from multiprocessing import cpu_count
+from pathlib import Path
+from statistics import median
+from subprocess import DEVNULL, PIPE, Popen
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep, time
+
+SELF_PATH = Path(__file__).resolve().parent
+ROOT_PATH = SELF_PATH.parent
+
+sys.path.insert(0, str(ROOT_PATH))
+
+from portfolio.preprocess import apply_stage, describe_stage, engine_stages
+from portfolio.process import is_alive, read_stat
+
+
+STUBS = {
+    'z3-spacer': 'z3',
+    'freqhorn': 'freqhorn',
+    'lig-chc': 'lig-chc.sh',
+}
+
+# Absolute slack on top of the relative tolerance, so that scheduling noise on tiny values is not reported
+SLACK = {
+    'peak_rss': 8.0,
+    'leaked': 0,
+}
+DEFAULT_SLACK = 0.05
+
+
+def build_sandbox(sandbox):
+    # The portfolio is copied next to stub executables, so the real runners are measured unmodified
+    shutil.copy2(ROOT_PATH.joinpath('solver.py'), sandbox)
+    for directory in ('portfolio', 'processors', 'translators'):
+        if ROOT_PATH.joinpath(directory).is_dir():
+            shutil.copytree(ROOT_PATH.joinpath(directory), sandbox.joinpath(directory),
+                            ignore=shutil.ignore_patterns('__pycache__'))
+
+    engines_path = sandbox.joinpath('engines')
+    engines_path.mkdir()
+    shutil.copy2(ROOT_PATH.joinpath('engines', '__init__.py'), engines_path)
+    for engine, binary in STUBS.items():
+        engine_path = engines_path.joinpath(engine)
+        engine_path.mkdir()
+        for source in ROOT_PATH.joinpath('engines', engine).glob('*.py'):
+            shutil.copy2(source, engine_path)
+
+        wrapper = engine_path.joinpath(binary)
+        wrapper.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{SELF_PATH.joinpath("stub_engine.py")}" {engine} "$@"\n')
+        wrapper.chmod(0o755)
+
+    sandbox.joinpath('tmp').mkdir()
+
+def process_flags(scenario):
+    flags = scenario.get('flags', [])
+    processors = dict()
+    for flag, value in zip(flags, flags[1:]):
+        if flag in ('-p', '--process'):
+            engine, processor = value.split(':')
+            processors.setdefault(engine, []).append(processor)
+    return processors
+
+def measure_preprocessing(scenario, sandbox):
+    args = Namespace(format=scenario.get('format', 'smt'),
+                     process=process_flags(scenario),
+                     processors_path=sandbox.joinpath('processors'),
+                     translators_path=sandbox.joinpath('translators'),
+                     temp_path=sandbox.joinpath('tmp'))
+
+    timings = dict()
+    for engine in scenario['engines']:
+        input_file = SELF_PATH.joinpath(scenario['input'])
+        for stage in engine_stages(engine, args):
+            start = perf_counter()
+            input_file = apply_stage(stage, input_file, args)
+            timings[f'preprocess:{engine}:{describe_stage(stage)}'] = perf_counter() - start
+    return timings
+
+def run_portfolio(scenario, sandbox):
+    scenario_path = sandbox.joinpath('scenario.json')
+    scenario_path.write_text(json.dumps(scenario))
+    events_path = sandbox.joinpath('events.jsonl')
+    events_path.write_text('')
+
+    # Every engine gets a slot by default, so the results do not depend on the number of CPUs
+    command = [sys.executable, sandbox.joinpath('solver.py'), '-l', 'CRITICAL', '-f', scenario.get('format', 'smt'),
+               '-j', str(len(scenario['engines']))]
+    for engine in scenario['engines']:
+        command.extend(['-e', engine])
+    command.extend(scenario.get('flags', []))
+    command.append(SELF_PATH.joinpath(scenario['input']))
+
+    env = {**os.environ, 'BENCH_SCENARIO': str(scenario_path), 'BENCH_EVENTS': str(events_path)}
+    started = time()
+    process = Popen(command, stdout=PIPE, stderr=DEVNULL, env=env)
+    first_line = process.stdout.readline()
+    first_output = time()
+    process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    finished = time()
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    events = [json.loads(line) for line in events_path.read_text().splitlines()]
+    solved = process.returncode == 0 and bool(first_line.strip())
+
+    metrics = {
+        'total': finished - started,
+        'peak_rss': usage.ru_maxrss / 1024,
+    }
+    starts = [e['time'] for e in events if e['event'] == 'start']
+    if starts:
+        metrics['startup'] = min(starts) - started
+    if solved:
+        metrics['first_result'] = first_output - started
+
+        # The winner is the first scripted solver to exit without having been asked to terminate
+        terminated = set(e['pid'] for e in events if e['event'] == 'term')
+        exits = [e['time'] for e in events
+                 if e['event'] == 'exit' and e['pid'] not in terminated
+                 and scenario['engines'][e['engine']].get('outcome', 'sat') == 'sat']
+        if exits:
+            metrics['cancellation'] = first_output - min(exits)
+
+    # Stub processes that outlive the portfolio indicate a broken cancellation
+    sleep(0.1)
+    leaked = 0
+    for pid in set(e['pid'] for e in events):
+        stat = read_stat(pid)
+        if stat and is_alive(stat):
+            os.kill(pid, 9)
+            leaked += 1
+    metrics['leaked'] = leaked
+
+    return ('solved' if solved else 'failed'), metrics
+
+def run_scenario(scenario, repeat):
+    with TemporaryDirectory(prefix='portfolio-bench-') as sandbox:
+        sandbox = Path(sandbox)
+        build_sandbox(sandbox)
+
+        samples, statuses = dict(), []
+        for _ in range(repeat):
+            status, metrics = run_portfolio(scenario, sandbox)
+            statuses.append(status)
+            metrics.update(measure_preprocessing(scenario, sandbox))
+            for metric, value in metrics.items():
+                samples.setdefault(metric, []).append(value)
+
+    status = statuses[0] if len(set(statuses)) == 1 else 'flaky'
+    return {'status': status, 'metrics': {metric: median(values) for metric, values in samples.items()}}
+
+def compare(results, baseline, tolerance):
+    problems = []
+    for name, result in results['scenarios'].items():
+        if result['status'] != result['expect']:
+            problems.append(f'{name}: expected {result["expect"]} but was {result["status"]}')
+
+        reference = baseline.get('scenarios', {}).get(name)
+        if reference is None:
+            continue
+        for metric, value in result['metrics'].items():
+            if metric not in reference['metrics']:
+                continue
+            limit = reference['metrics'][metric] * (1 + tolerance) + SLACK.get(metric, DEFAULT_SLACK)
+            if value > limit:
+                problems.append(f'{name}: {metric} regressed from {reference["metrics"][metric]:.3f}'
+                                f' to {value:.3f} (limit {limit:.3f})')
+    return problems
+
+def main(args):
+    scenarios = json.loads(args.scenarios.read_text())
+    if args.only:
+        scenarios = [s for s in scenarios if s['name'] in args.only]
+
+    results = {'cpus': cpu_count(), 'python': sys.version.split()[0], 'repeat': args.repeat, 'scenarios': dict()}
+    print(f'{"scenario":28} {"metric":56} {"value":>10}')
+    for scenario in scenarios:
+        result = run_scenario(scenario, args.repeat)
+        result['expect'] = scenario.get('expect', 'solved')
+        results['scenarios'][scenario['name']] = result
+
+        print(f'{scenario["name"]:28} {"status":56} {result["status"]:>10}')
+        for metric, value in sorted(result['metrics'].items()):
+            print(f'{"":28} {metric[-56:]:56} {value:10.3f}')
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + '\n')
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2) + '\n')
+        print(f'Updated baseline at "{args.baseline}".', file=sys.stderr)
+        return 0
+
+    baseline = dict()
+    if args.baseline.is_file():
+        baseline = json.loads(args.baseline.read_text())
+    else:
+        print(f'No baseline at "{args.baseline}"; only checking the expected statuses.', file=sys.stderr)
+
+    problems = compare(results, baseline, args.tolerance)
+    for problem in problems:
+        print(f'REGRESSION: {problem}', file=sys.stderr)
+    return 1 if problems else 0
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-s', '--scenarios', type=Path, default=SELF_PATH.joinpath('scenarios.json'),
+                        help='JSON file describing the scripted engine behaviors')
+    parser.add_argument('--only', action='append',
+                        help='Only run the named scenario')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Number of runs per scenario (the median is reported)')
+    parser.add_argument('-o', '--output', type=Path,
+                        help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', type=Path, default=SELF_PATH.joinpath('baseline.json'),
+                        help='Results to compare against')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='Store the results as the new baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Relative slowdown over the baseline that is reported as a regression')
+
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import sys
+import tracemalloc
+
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from portfolio.sexp import iter_commands, parse
+
+
+def generate_chc(predicates, clauses, depth):
+    lines = ['(set-logic HORN)']
+    for p in range(predicates):
+        lines.append(f'(declare-fun |inv {p}| (Int Int) Bool)')
+    for c in range(clauses):
+        p, q = c % predicates, (c + 1) % predicates
+        body = 'x'
+        for d in range(depth):
+            body = f'(let ((v{d} (+ {body} {d}))) (ite (> v{d} y) v{d} (- v{d} 1)))'
+        lines.append(f'; clause {c}')
+        lines.append(f'(assert (forall ((x Int) (y Int)) (=> (and (|inv {p}| x y) (= "s" "s")) (|inv {q}| {body} y))))')
+    lines.append('(check-sat)')
+    return '\n'.join(lines)
+
+def pyparsing_parser():
+    import pyparsing as pp
+
+    pp.ParserElement.enablePackrat()
+    i_expr = pp.QuotedString(quoteChar='"') | pp.QuotedString(quoteChar='|', unquoteResults=False)
+    s_expr = pp.nestedExpr(opener='(', closer=')', ignoreExpr=i_expr)
+    s_expr.ignore(';' + pp.restOfLine)
+
+    parser = pp.ZeroOrMore(s_expr)
+    return lambda text: parser.parseString(text, parseAll=True).asList()
+
+def measure(parse_text, text, repeat):
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        parse_text(text)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    parse_text(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+def main(args):
+    inputs = [(path, path.read_text()) for path in args.input_file]
+    if not inputs:
+        inputs = [(f'synthetic ({args.clauses} clauses)', generate_chc(args.predicates, args.clauses, args.depth))]
+
+    parsers = [('portfolio.sexp', parse)]
+    try:
+        parsers.append(('pyparsing', pyparsing_parser()))
+    except ImportError:
+        print('pyparsing is not installed; only measuring portfolio.sexp.', file=sys.stderr)
+
+    print(f'{"input":40} {"parser":16} {"size (KB)":>10} {"time (s)":>10} {"peak (MB)":>10}')
+    for name, text in inputs:
+        with NamedTemporaryFile('w', suffix='.smt2') as tfile_handle:
+            tfile_handle.write(text)
+            tfile_handle.flush()
+
+            stream = lambda _: sum(1 for _ in iter_commands(tfile_handle.name))
+            for parser_name, parse_text in parsers + [('streamed', stream)]:
+                elapsed, peak = measure(parse_text, text, args.repeat)
+                print(f'{str(name)[-40:]:40} {parser_name:16} {len(text) / 1024:10.1f} {elapsed:10.3f} {peak / 2**20:10.1f}')
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-p', '--predicates', type=int, default=50,
+                        help='Number of predicates in the synthetic input')
+    parser.add_argument('-c', '--clauses', type=int, default=2000,
+                        help='Number of clauses in the synthetic input')
+    parser.add_argument('-d', '--depth', type=int, default=8,
+                        help='Nesting depth of let-terms in the synthetic input')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Number of timed runs per parser (the best one is reported)')
+    parser.add_argument('input_file', type=Path, nargs='*',
+                        help='CHC files to parse instead of a synthetic input')
+
+    main(parser.parse_args())
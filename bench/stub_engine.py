@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import signal
+import sys
+
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from pathlib import Path
+from time import sleep, time
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from portfolio.sexp import iter_commands, serialize
+
+
+DEFAULT_BEHAVIOR = {'outcome': 'sat', 'delay': 0.0, 'ignore_term': False, 'memory': 0}
+
+
+def record(engine, event):
+    events_path = os.environ.get('BENCH_EVENTS')
+    if events_path:
+        with open(events_path, 'a') as events_handle:
+            events_handle.write(json.dumps({'engine': engine, 'event': event, 'time': time(), 'pid': os.getpid()}) + '\n')
+
+def behavior(engine):
+    scenario_path = os.environ.get('BENCH_SCENARIO')
+    if not scenario_path:
+        return DEFAULT_BEHAVIOR
+    with open(scenario_path, 'r') as scenario_handle:
+        return {**DEFAULT_BEHAVIOR, **json.load(scenario_handle)['engines'].get(engine, {})}
+
+def solution(input_file):
+    # Every uninterpreted predicate is interpreted as true, which is enough for the portfolio to forward
+    definitions = []
+    for statement in iter_commands(input_file, heads={'declare-fun', 'synth-fun', 'synth-inv'}):
+        if statement[0] == 'declare-fun' and statement[-1] == 'Bool':
+            parameters = [[f'x{i}', sort] for i, sort in enumerate(statement[2])]
+            definitions.append(['define-fun', statement[1], parameters, 'Bool', 'true'])
+        elif statement[0] != 'declare-fun':
+            definitions.append(['define-fun', statement[1], statement[2], 'Bool', 'true'])
+    return [serialize(definition) for definition in definitions]
+
+def main(args):
+    settings = behavior(args.engine)
+
+    def terminate(signum, frame):
+        record(args.engine, 'term')
+        if not settings['ignore_term']:
+            record(args.engine, 'exit')
+            os._exit(128 + signum)
+    signal.signal(signal.SIGTERM, terminate)
+
+    record(args.engine, 'start')
+    ballast = bytearray(settings['memory'] * 2**20)
+    ballast[::4096] = b'\x01' * len(ballast[::4096])
+
+    if settings['outcome'] == 'hang':
+        while True:
+            sleep(1)
+    sleep(settings['delay'])
+
+    if settings['outcome'] == 'error':
+        print(f'{args.engine}: scripted failure', file=sys.stderr)
+        record(args.engine, 'exit')
+        exit(1)
+
+    if settings['outcome'] == 'unsupported':
+        print('Unsupported feature')
+    elif args.engine == 'z3-spacer':
+        print('sat')
+        print('(model')
+        print('\n'.join(f'  {definition}' for definition in solution(args.input_file)))
+        print(')')
+    elif args.engine == 'freqhorn':
+        print('Success after 1 iteration')
+        print('\n'.join(solution(args.input_file)))
+    else:
+        print('\n'.join(solution(args.input_file)))
+
+    sys.stdout.flush()
+    record(args.engine, 'exit')
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('engine', type=str,
+                        help='Name of the engine that is being replaced')
+    parser.add_argument('options', type=str, nargs='*',
+                        help='Engine-specific flags passed by the runner, which are ignored')
+    parser.add_argument('input_file', type=Path,
+                        help='Path to the input file passed by the runner')
+
+    main(parser.parse_args())
@@ -1,33 +1,38 @@
-import pyparsing as pp
+import re
 
 from pathlib import Path
-from subprocess import PIPE, run
-from tempfile import mkstemp as make_tempfile
+
+from portfolio import telemetry
+from portfolio.preprocess import has_get_model
+from portfolio.sexp import iter_commands, parse, ParseError, scan_lists, unquote
 
 
 ENGINE = 'z3-spacer'
 FORMAT = 'smt'
+HINTS = True
+
+# Spacer settings that win on different instances than the default one
+CONFIGURATIONS = {
+    'global-guidance': {'priority': 1, 'options': ['fp.spacer.global=true']},
+    'no-inline': {'priority': 1, 'options': ['fp.xform.inline_linear=false', 'fp.xform.inline_eager=false',
+                                             'fp.xform.tail_simplifier_pve=false']},
+    'seed-1': {'priority': 2, 'options': ['fp.spacer.random_seed=1', 'smt.random_seed=1']},
+    'seed-2': {'priority': 2, 'options': ['fp.spacer.random_seed=2', 'smt.random_seed=2']},
+}
 
 
 logger = None
-parser = None
-tracked_symbols = []
 
-pp.ParserElement.enablePackrat()
+DEFINITION = re.compile(rb'''\(\s*define-fun\s+(\|[^|]*\||[^\s()";|]+)''')
+INDUCTIVE_LEMMA = b'** add-lemma: oo '
 
 
 def setup(args):
-    global logger, parser
+    global logger
 
     logger = args.logging.getLogger(f'({ENGINE})')
     logger.setLevel(args.logging.getLevelName(args.log_level))
 
-    i_expr = pp.QuotedString(quoteChar='"') | pp.QuotedString(quoteChar='|', unquoteResults=False)
-    s_expr = pp.nestedExpr(opener='(', closer=')', ignoreExpr=i_expr)
-    s_expr.ignore(';' + pp.restOfLine)
-
-    parser = pp.ZeroOrMore(s_expr)
-
 def quote_name(name):
     pre, post = '', ''
     if not name.startswith('|'):
@@ -37,98 +42,67 @@ def quote_name(name):
     return f'{pre}{name}{post}'
 
 def preprocess(args):
-    global logger, parser, tracked_symbols
-
-    from mmap import ACCESS_READ, mmap
-
-    if args.format != FORMAT:
-        _, tfile_path = make_tempfile(dir=args.temp_path, suffix=f'.z3-spacer.from-{args.format}.{FORMAT}')
-        
-        translator = args.translators_path.joinpath(f'{args.format}-to-{FORMAT}.py')
-        if not translator.is_file():
-            logger.error(f'Could not locate translator "{translator}"!')
-            raise FileNotFoundError(translator)
-
-        logger.debug(f'Translating from {args.format} -> {tfile_path}: python3 {translator} {args.input_file}')
-        result = run(['python3', translator, args.input_file], stdout=PIPE, stderr=PIPE)
-        result.check_returncode()
-
-        with open(tfile_path, 'w') as tfile_handle:
-            tfile_handle.writelines(result.stdout.decode('utf-8'))
-        args.input_file = tfile_path
-
-    get_model_needed = True
-    with open(args.input_file, 'rb', 0) as file:
-        with mmap(file.fileno(), 0, access=ACCESS_READ) as s:
-            if s.find(b'(get-model)') != -1:
-                get_model_needed = False
-
-    if get_model_needed:
-        from shutil import copyfile
-
-        _, tfile_path = make_tempfile(dir=args.temp_path, suffix=f'.z3-spacer.smt')
-        copyfile(args.input_file, tfile_path)
-
-        with open(tfile_path, 'a') as tfile_handle:
-            tfile_handle.write('\n(get-model)\n')
-        args.input_file = tfile_path
-
-    tracked_symbols = [
-        quote_name(stmt[1])
-        for stmt in parser.parseFile(args.input_file, parseAll=True).asList()
-        if stmt[0] == 'declare-fun'
-    ]
-    logger.debug(tracked_symbols)
+    # The symbols are kept with the arguments of this run, as runners are shared by all instances of a batch,
+    # along with their arities, which name the variables of the lemmas
+    args.tracked_symbols = {
+        quote_name(stmt[1]): len(stmt[2])
+        for stmt in iter_commands(args.input_file, heads={'declare-fun'})
+    }
+    logger.debug(args.tracked_symbols)
 
     return args
 
-def serialize(statement):
-    if type(statement) is not list:
-        return statement
-    return f'({" ".join(serialize(e) for e in statement)})'
-
-def shrink(output):
-    global logger, parser, tracked_symbols
-
+def shrink(lines, tracked_symbols):
+    # Only the name of each definition is matched, and the accepted ones are copied as printed by the solver
     result = []
-    for stmt in parser.parseString(output, parseAll=True).asList()[0][1:]:
-        if stmt[0] == 'define-fun':
-            stmt[1] = quote_name(stmt[1])
-            if stmt[1] in tracked_symbols:
-                result.append(stmt)
-
-    return '\n'.join(serialize(stmt) for stmt in result)
-
-def solve(args):
-    global logger
-
-    solver_path = Path(__file__).resolve().parent.joinpath('z3')
-
-    logger.debug(f'Exec: {solver_path} {args.input_file}')
-    result = run([solver_path, args.input_file], stdout=PIPE, stderr=PIPE)
-    
-    try:
-        result.check_returncode()
-        
-        log_error, error = '', result.stderr.decode('utf-8').strip()
-        if error:
-            log_error = f'\nSTDERR:\n{error}'
-        
-        log_output, output = '', result.stdout.decode('utf-8').strip()
-        if output:
-            log_output = f'\nSTDOUT:\n{output}'
-        logger.debug(f'Raw solver output:{log_error}{log_output}')
-
-        return shrink(output[output.find('\n')+1:])
-    except Exception as e:
-        log_error, error = '', result.stderr.decode('utf-8').strip()
-        if error:
-            log_error = f'\nSTDERR:\n{error}'
-        
-        log_output, output = '', result.stdout.decode('utf-8').strip()
-        if output:
-            log_output = f'\nSTDOUT:\n{output}'
-
-        logger.error(f'Solver terminated with an error!{error}{output}')
-        logger.exception(e)
-        return None
+    for definition in scan_lists(lines, depth=1):
+        match = DEFINITION.match(definition)
+        if match and quote_name(match.group(1).decode('utf-8')) in tracked_symbols:
+            result.append(definition.decode('utf-8'))
+
+    return '\n'.join(result)
+
+def command(args):
+    # Without a (get-model) command in the input, z3 is asked to print the model on its own,
+    # so the input is passed unmodified
+    flags = [] if has_get_model(args.input_file) else ['dump_models=true']
+    # z3 takes any argument with a slash for an input file, and is started in the directory of its trace
+    if getattr(args, 'trace_path', None):
+        flags.append(f'fp.spacer.trace_file={args.trace_path.name}')
+    return [Path(__file__).resolve().parent.joinpath('z3'), *args.options, *flags, args.input_file]
+
+def answer(output, args):
+    status = output.status()
+    logger.debug(f'Solver answered: {status}')
+    if status != 'sat':
+        raise AssertionError(f'Unexpected answer: {status}')
+
+    with telemetry.span('shrink', 'engine'):
+        return shrink(output.lines(), args.tracked_symbols)
+
+def lemmas(trace, args):
+    # Spacer logs every lemma it learns, with its level, the predicate and the lemma on the lines that follow.
+    # The lemmas at the infinity level are inductive, over the parameters named <predicate>_<index>_n.
+    lines = iter(trace)
+    for line in lines:
+        if not line.startswith(INDUCTIVE_LEMMA):
+            continue
+        predicate = next(lines, b'').decode('utf-8').strip()
+        text = []
+        for line in lines:
+            if not line.strip():
+                break
+            text.append(line)
+        if quote_name(predicate) not in args.tracked_symbols:
+            continue
+        try:
+            lemma = parse(b''.join(text).decode('utf-8'))
+        except (ParseError, UnicodeDecodeError):
+            continue
+        if len(lemma) != 1:
+            continue
+
+        quoted = predicate.startswith('|')
+        parameters = [f'|{unquote(predicate)}_{i}_n|' if quoted else f'{predicate}_{i}_n'
+                      for i in range(args.tracked_symbols[quote_name(predicate)])]
+        yield predicate, parameters, lemma[0]
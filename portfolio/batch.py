@@ -0,0 +1,102 @@
+import json
+
+from copy import copy
+from glob import glob
+from importlib import import_module
+from pathlib import Path
+
+from portfolio.cache import problem_key
+from portfolio.configurations import engine_of
+from portfolio.scheduler import FAILURE_STATUSES, Scheduler
+
+
+SUFFIXES = {
+    'smt': ('.smt2', '.smt'),
+    'sygus': ('.sl', '.sy'),
+}
+
+
+def collect_inputs(sources, fmt, logger):
+    inputs = []
+    for source in sources:
+        path = Path(source)
+        if path.is_dir():
+            inputs.extend(sorted(p for p in path.rglob('*') if p.is_file() and p.suffix in SUFFIXES[fmt]))
+        elif path.is_file() and path.suffix in SUFFIXES[fmt]:
+            inputs.append(path)
+        elif path.is_file():
+            logger.debug(f'Reading manifest "{path}" ...')
+            with open(path, 'r') as manifest_handle:
+                for line in manifest_handle:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        inputs.append(path.parent.joinpath(line))
+        else:
+            matches = sorted(glob(source, recursive=True))
+            if not matches:
+                logger.warning(f'Batch source "{source}" did not match any input!')
+            inputs.extend(Path(m) for m in matches if Path(m).is_file())
+
+    unique_inputs = []
+    for path in (p.resolve() for p in inputs):
+        if path not in unique_inputs:
+            unique_inputs.append(path)
+    return unique_inputs
+
+def warm_up(engines, logger):
+    # Runners are imported once here, so neither the engines started directly nor the forked workers import them again
+    for engine in set(map(engine_of, engines)):
+        try:
+            import_module(f'engines.{engine}.runner')
+        except Exception as e:
+            logger.debug(f'Could not preload runner for "{engine}" engine: {e}')
+
+def print_record(input_file, engine, result, elapsed, cached=False):
+    failed = result in FAILURE_STATUSES
+    print(json.dumps({
+        'input': str(input_file),
+        'status': result if failed else 'SOLVED',
+        'engine': engine,
+        'result': None if failed else result,
+        'time': round(elapsed, 3),
+        'cached': cached,
+    }), flush=True)
+    return not failed
+
+def run_batch(args, engines, cache, history, invariants, logger):
+    inputs = collect_inputs(args.batch, args.format, logger)
+    logger.info(f'Collected {len(inputs)} input(s) for batch solving.')
+
+    warm_up(engines, logger)
+
+    solved, cache_keys = 0, dict()
+    scheduler = Scheduler(args, logger, max(1, args.jobs), history, invariants)
+    for input_file in inputs:
+        if cache:
+            try:
+                cache_keys[input_file] = problem_key(input_file, engines, args)
+                cached = cache.get(cache_keys[input_file])
+            except Exception as e:
+                logger.warning(f'Could not look up "{input_file}" in the result cache: {e}')
+                cached = None
+            if cached:
+                solved += print_record(input_file, *cached, 0, cached=True)
+                continue
+
+        instance_args = copy(args)
+        instance_args.input_file = input_file
+        scheduler.submit(input_file, engines, instance_args)
+
+    # Solutions that the past invariants still give are reported like cached ones, and are not recorded again
+    for input_file, engine, result, elapsed in scheduler.run():
+        if print_record(input_file, engine, result, elapsed, cached=engine == 'invariants'):
+            solved += 1
+            if invariants and engine != 'invariants':
+                invariants.record(input_file, engine, result)
+            if input_file in cache_keys:
+                cache.put(cache_keys[input_file], engine, result)
+
+    if cache:
+        logger.info(f'Result cache statistics: {cache.stats()}')
+    logger.info(f'Solved {solved} of {len(inputs)} input(s).')
+    return 0 if solved == len(inputs) else 1
@@ -0,0 +1,410 @@
+from portfolio.sexp import parse, serialize, unquote
+
+
+# Every helper is a (dependencies, signature and body) pair, instantiated for a single width.
+# A BitVec value x of width w is represented by any Int congruent to it modulo 2^w,
+# so wrap-around arithmetic is a single mod and inputs are only normalized where it matters.
+
+def signed(w):
+    return f'((x Int)) Int (let ((x (mod x {2 ** w}))) (ite (< x {2 ** (w - 1)}) x (- x {2 ** w})))'
+
+def arithmetic(op):
+    return lambda w: f'((x Int) (y Int)) Int (mod ({op} x y) {2 ** w})'
+
+def unsigned_compare(op):
+    return lambda w: f'((x Int) (y Int)) Bool ({op} (mod x {2 ** w}) (mod y {2 ** w}))'
+
+def signed_compare(op):
+    return lambda w: f'((x Int) (y Int)) Bool ({op} (bv_signed_{w} x) (bv_signed_{w} y))'
+
+def bit(x, i):
+    return f'(mod {x} 2)' if i == 0 else f'(mod (div {x} {2 ** i}) 2)'
+
+def bitwise(combine):
+    # Only bits are compared, so the terms stay linear for any width
+    def helper(w):
+        terms = [combine(f'(+ {bit("x", i)} {bit("y", i)})', 2 ** i) for i in range(w)]
+        total = terms[0] if w == 1 else f'(+ {" ".join(terms)})'
+        return f'((x Int) (y Int)) Int (let ((x (mod x {2 ** w})) (y (mod y {2 ** w}))) {total})'
+    return helper
+
+def negated(name):
+    return lambda w: f'((x Int) (y Int)) Int (bv_not_{w} ({name}_{w} x y))'
+
+def pow2(w):
+    # Shift amounts of at least the width all behave like a shift by the width itself
+    body = str(2 ** w)
+    for i in reversed(range(w)):
+        body = f'(ite (= x {i}) {2 ** i} {body})'
+    return f'((x Int)) Int (let ((x (mod x {2 ** w}))) {body})'
+
+HELPERS = {
+    'is_int': ((), lambda w: f'((x Int)) Bool (and (<= 0 x) (< x {2 ** w}))'),
+    'bv_signed': ((), signed),
+    'bv_pow2': ((), pow2),
+
+    'bv_ult': ((), unsigned_compare('<')),
+    'bv_ule': ((), unsigned_compare('<=')),
+    'bv_ugt': ((), unsigned_compare('>')),
+    'bv_uge': ((), unsigned_compare('>=')),
+
+    'bv_slt': (('bv_signed',), signed_compare('<')),
+    'bv_sle': (('bv_signed',), signed_compare('<=')),
+    'bv_sgt': (('bv_signed',), signed_compare('>')),
+    'bv_sge': (('bv_signed',), signed_compare('>=')),
+
+    'bv_add': ((), arithmetic('+')),
+    'bv_sub': ((), arithmetic('-')),
+    'bv_mul': ((), arithmetic('*')),
+    'bv_neg': ((), lambda w: f'((x Int)) Int (mod (- x) {2 ** w})'),
+
+    'bv_udiv': ((), lambda w: f'((x Int) (y Int)) Int (let ((x (mod x {2 ** w})) (y (mod y {2 ** w})))'
+                              f' (ite (= y 0) {2 ** w - 1} (div x y)))'),
+    'bv_urem': ((), lambda w: f'((x Int) (y Int)) Int (let ((x (mod x {2 ** w})) (y (mod y {2 ** w})))'
+                              f' (ite (= y 0) x (mod x y)))'),
+    'bv_sdiv': (('bv_signed',), lambda w: f'((x Int) (y Int)) Int (let ((x (bv_signed_{w} x)) (y (bv_signed_{w} y)))'
+                                          f' (ite (= y 0) (ite (< x 0) 1 {2 ** w - 1})'
+                                          f' (mod (ite (= (< x 0) (< y 0)) (div (abs x) (abs y)) (- (div (abs x) (abs y)))) {2 ** w})))'),
+    'bv_srem': (('bv_signed',), lambda w: f'((x Int) (y Int)) Int (let ((x (bv_signed_{w} x)) (y (bv_signed_{w} y)))'
+                                          f' (ite (= y 0) (mod x {2 ** w})'
+                                          f' (mod (ite (< x 0) (- (mod (abs x) (abs y))) (mod (abs x) (abs y))) {2 ** w})))'),
+    'bv_smod': (('bv_signed',), lambda w: f'((x Int) (y Int)) Int (let ((x (bv_signed_{w} x)) (y (bv_signed_{w} y)))'
+                                          f' (let ((u (ite (= y 0) (abs x) (mod (abs x) (abs y)))))'
+                                          f' (mod (ite (= u 0) 0 (ite (< x 0) (ite (< y 0) (- u) (- y u)) (ite (< y 0) (+ u y) u)))'
+                                          f' {2 ** w})))'),
+
+    'bv_shl': (('bv_pow2',), lambda w: f'((x Int) (y Int)) Int (mod (* x (bv_pow2_{w} y)) {2 ** w})'),
+    'bv_lshr': (('bv_pow2',), lambda w: f'((x Int) (y Int)) Int (div (mod x {2 ** w}) (bv_pow2_{w} y))'),
+    'bv_ashr': (('bv_signed', 'bv_pow2'), lambda w: f'((x Int) (y Int)) Int'
+                                                    f' (mod (div (bv_signed_{w} x) (bv_pow2_{w} y)) {2 ** w})'),
+
+    'bv_not': ((), lambda w: f'((x Int)) Int (- {2 ** w - 1} (mod x {2 ** w}))'),
+    'bv_and': ((), bitwise(lambda bits, value: f'(ite (= {bits} 2) {value} 0)')),
+    'bv_or': ((), bitwise(lambda bits, value: f'(ite (= {bits} 0) 0 {value})')),
+    'bv_xor': ((), bitwise(lambda bits, value: f'(* {value} (mod {bits} 2))')),
+    'bv_nand': (('bv_not', 'bv_and'), negated('bv_and')),
+    'bv_nor': (('bv_not', 'bv_or'), negated('bv_or')),
+    'bv_xnor': (('bv_not', 'bv_xor'), negated('bv_xor')),
+    'bv_comp': ((), lambda w: f'((x Int) (y Int)) Int (ite (= (mod x {2 ** w}) (mod y {2 ** w})) 1 0)'),
+}
+
+OPERATIONS = {
+    'bvslt': 'bv_slt', 'bvsle': 'bv_sle', 'bvsgt': 'bv_sgt', 'bvsge': 'bv_sge',
+    'bvult': 'bv_ult', 'bvule': 'bv_ule', 'bvugt': 'bv_ugt', 'bvuge': 'bv_uge',
+
+    'bvadd': 'bv_add', 'bvsub': 'bv_sub', 'bvmul': 'bv_mul', 'bvneg': 'bv_neg',
+    'bvudiv': 'bv_udiv', 'bvurem': 'bv_urem',
+    'bvsdiv': 'bv_sdiv', 'bvsrem': 'bv_srem', 'bvsmod': 'bv_smod',
+
+    'bvshl': 'bv_shl', 'bvlshr': 'bv_lshr', 'bvashr': 'bv_ashr',
+
+    'bvnot': 'bv_not', 'bvand': 'bv_and', 'bvor': 'bv_or', 'bvxor': 'bv_xor',
+    'bvnand': 'bv_nand', 'bvnor': 'bv_nor', 'bvxnor': 'bv_xnor', 'bvcomp': 'bv_comp',
+}
+
+# Without range constraints the arithmetic is not wrapped around, so it maps to the plain Int operations
+UNBOUNDED_OPERATIONS = {
+    'bvslt': '<', 'bvsle': '<=', 'bvsgt': '>', 'bvsge': '>=',
+    'bvult': '<', 'bvule': '<=', 'bvugt': '>', 'bvuge': '>=',
+
+    'bvadd': '+', 'bvsub': '-', 'bvmul': '*', 'bvneg': '-',
+}
+
+PREDICATES = {'bvslt', 'bvsle', 'bvsgt', 'bvsge', 'bvult', 'bvule', 'bvugt', 'bvuge'}
+
+
+def is_bv_type(ast):
+    return (type(ast) is list and
+            len(ast) == 3 and
+            ast[0] == '_' and
+            ast[1] == 'BitVec')
+
+def bv_width(sort):
+    return int(sort[2]) if is_bv_type(sort) else None
+
+def replace_bv_type(ast):
+    if type(ast) is not list:
+        return ast
+    if is_bv_type(ast):
+        return 'Int'
+    return [replace_bv_type(e) for e in ast]
+
+def bv_literal(atom):
+    if atom.startswith('#x'):
+        return str(int(atom[2:], 16)), 4 * (len(atom) - 2)
+    if atom.startswith('#b'):
+        return str(int(atom[2:], 2)), len(atom) - 2
+    return None
+
+def indexed(op, indices, args, widths):
+    # Operations that change the width are lowered inline, as they only need constants
+    if op == 'extract':
+        high, low = indices
+        if low == 0:
+            return ['mod', args[0], str(2 ** (high + 1))], high - low + 1
+        return ['mod', ['div', args[0], str(2 ** low)], str(2 ** (high - low + 1))], high - low + 1
+
+    width = widths[0]
+    if op == 'zero_extend':
+        return ['mod', args[0], str(2 ** width)], width + indices[0]
+    if op == 'sign_extend':
+        return ['mod', [f'bv_signed_{width}', args[0]], str(2 ** (width + indices[0]))], width + indices[0]
+    if op == 'repeat':
+        factor = sum(2 ** (width * i) for i in range(indices[0]))
+        return ['*', ['mod', args[0], str(2 ** width)], str(factor)], width * indices[0]
+    if op in ('rotate_left', 'rotate_right'):
+        shift = indices[0] % width if op == 'rotate_left' else -indices[0] % width
+        value = ['mod', args[0], str(2 ** width)]
+        if shift == 0:
+            return value, width
+        return ['+', ['mod', ['*', args[0], str(2 ** shift)], str(2 ** width)],
+                     ['div', value, str(2 ** (width - shift))]], width
+    raise NotImplementedError(f'BitVec operation {op} has not been implemented.')
+
+
+class Scope:
+    # Every symbol maps to a stack of the widths it is bound to, innermost last,
+    # so lookups and leaving a binder take constant time regardless of the nesting depth
+    def __init__(self):
+        self.bindings = dict()
+
+    def __contains__(self, name):
+        return name in self.bindings
+
+    def bind(self, name, width):
+        self.bindings.setdefault(name, []).append(width)
+
+    def unbind(self, names):
+        for name in names:
+            widths = self.bindings[name]
+            widths.pop()
+            if not widths:
+                del self.bindings[name]
+
+    def lookup(self, name):
+        return self.bindings[name][-1]
+
+
+VISIT, APPLY, LET_BODY, LET_END, QUANTIFIER_END = range(5)
+
+class BVRewriter:
+    def __init__(self, bounded=True, metadata=None):
+        self.bounded = bounded
+        self.metadata = dict() if metadata is None else metadata
+        self.scope = Scope()
+        self.functions = dict()
+
+        self.helpers = []
+        self.required = set()
+        self.emitted = 0
+
+    def require(self, name, width):
+        # Dependencies are added first, so every helper is defined before its first use
+        if (name, width) in self.required:
+            return
+        for dependency in HELPERS[name][0]:
+            self.require(dependency, width)
+        self.required.add((name, width))
+        self.helpers.append((name, width))
+
+    def definitions(self):
+        pending = self.helpers[self.emitted:]
+        self.emitted = len(self.helpers)
+        return [['define-fun', f'{name}_{width}'] + parse(HELPERS[name][1](width))
+                for name, width in pending]
+
+    def atom(self, atom):
+        literal = bv_literal(atom)
+        if literal:
+            return literal
+        if atom in self.scope:
+            return atom, self.scope.lookup(atom)
+        return atom, self.functions.get(atom)
+
+    def operand_width(self, term, widths, required=True):
+        widths = set(filter(None, widths))
+        if len(widths) > 1:
+            raise Exception(f'Ambiguous BitVec width: {serialize(term)}')
+        if not widths:
+            if not required:
+                return None
+            raise NotImplementedError(f'Could not infer the BitVec width of: {serialize(term)}')
+        return widths.pop()
+
+    def apply(self, term, args):
+        op, widths = term[0], [width for _, width in args]
+        args = [arg for arg, _ in args]
+
+        if type(op) is list:
+            if op[0] == '_' and op[1] != 'BitVec':
+                if op[1] != 'extract':
+                    self.operand_width(term, widths)
+                if op[1] == 'sign_extend':
+                    self.require('bv_signed', widths[0])
+                return indexed(op[1], [int(i) for i in op[2:]], args, widths)
+            return [replace_bv_type(op)] + args, None
+
+        if op == 'concat':
+            if None in widths:
+                raise NotImplementedError(f'Could not infer the BitVec width of: {serialize(term)}')
+            total, offset = [], sum(widths)
+            for arg, width in zip(args, widths):
+                offset -= width
+                value = ['mod', arg, str(2 ** width)]
+                total.append(value if offset == 0 else ['*', value, str(2 ** offset)])
+            return ['+'] + total, sum(widths)
+
+        if not self.bounded and op in UNBOUNDED_OPERATIONS:
+            width = self.operand_width(term, widths, required=False)
+            return [UNBOUNDED_OPERATIONS[op]] + args, None if op in PREDICATES else width
+
+        helper = OPERATIONS.get(op)
+        if helper:
+            width = self.operand_width(term, widths)
+            self.require(helper, width)
+            if op == 'bvcomp':
+                return [f'{helper}_{width}'] + args, 1
+            return [f'{helper}_{width}'] + args, None if op in PREDICATES else width
+
+        if op == 'ite':
+            return [op] + args, widths[1] or widths[2]
+        return [op] + args, self.functions.get(op)
+
+    def bind_variables(self, variables):
+        guards = []
+        for name, sort in variables:
+            width = bv_width(sort)
+            self.scope.bind(name, width)
+            if width and self.bounded:
+                self.require('is_int', width)
+                guards.append([f'is_int_{width}', name])
+        return [[name, replace_bv_type(sort)] for name, sort in variables], guards
+
+    def term(self, root):
+        # Terms are rewritten bottom-up with an explicit stack, so every node is visited once
+        # and its width is computed from the already rewritten children
+        results, stack = [], [(VISIT, root, None)]
+        while stack:
+            action, term, extra = stack.pop()
+
+            if action == VISIT:
+                if type(term) is not list:
+                    results.append(self.atom(term))
+                elif not term:
+                    results.append((term, None))
+                elif term[0] in ('forall', 'exists'):
+                    stack.append((QUANTIFIER_END, term, self.bind_variables(term[1])))
+                    stack.append((VISIT, term[2], None))
+                elif term[0] == 'let':
+                    stack.append((LET_BODY, term, None))
+                    stack.extend((VISIT, value, None) for _, value in reversed(term[1]))
+                elif term[0] == '_' and len(term) == 3 and term[1].startswith('bv') and term[1][2:].isdigit():
+                    results.append((term[1][2:], int(term[2])))
+                elif is_bv_type(term):
+                    results.append(('Int', None))
+                else:
+                    stack.append((APPLY, term, None))
+                    stack.extend((VISIT, arg, None) for arg in reversed(term[1:]))
+
+            elif action == APPLY:
+                args = results[len(results) - len(term) + 1:]
+                del results[len(results) - len(term) + 1:]
+                results.append(self.apply(term, args))
+
+            elif action == LET_BODY:
+                # The bound values were rewritten in the enclosing scope, as let binds in parallel
+                values = results[len(results) - len(term[1]):]
+                del results[len(results) - len(term[1]):]
+                for (name, _), (_, width) in zip(term[1], values):
+                    self.scope.bind(name, width)
+                stack.append((LET_END, term, values))
+                stack.append((VISIT, term[2], None))
+
+            elif action == LET_END:
+                body, width = results.pop()
+                self.scope.unbind(name for name, _ in term[1])
+                bindings = [[name, value] for (name, _), (value, _) in zip(term[1], extra)]
+                results.append((['let', bindings, body], width))
+
+            elif action == QUANTIFIER_END:
+                body, _ = results.pop()
+                self.scope.unbind(name for name, _ in term[1])
+                variables, guards = extra
+                if guards and term[0] == 'exists':
+                    # A witness must itself be in range, so the guard is conjoined instead of assumed
+                    body = ['and'] + guards + [body]
+                elif guards:
+                    guard = guards[0] if len(guards) == 1 else ['and'] + guards
+                    if type(body) is list and body[0] == '=>':
+                        body = ['=>', ['and', guard, body[1]]] + body[2:]
+                    else:
+                        body = ['=>', guard, body]
+                results.append(([term[0], variables, body], None))
+
+        return results.pop()
+
+    def statement(self, statement):
+        if statement[0] == 'declare-fun':
+            self.functions[statement[1]] = bv_width(statement[3])
+            if any(map(is_bv_type, statement[2])) or is_bv_type(statement[3]):
+                # The original signature lets the post-step restore the sorts of the model exactly
+                self.metadata.setdefault('signatures', dict())[unquote(statement[1])] = statement[2] + [statement[3]]
+            return ['declare-fun', statement[1], [replace_bv_type(s) for s in statement[2]], replace_bv_type(statement[3])]
+
+        if statement[0] == 'declare-const':
+            self.functions[statement[1]] = bv_width(statement[2])
+            return ['declare-const', statement[1], replace_bv_type(statement[2])]
+
+        if statement[0] == 'define-fun':
+            _, name, parameters, sort, body = statement
+            for parameter, parameter_sort in parameters:
+                self.scope.bind(parameter, bv_width(parameter_sort))
+            body, _ = self.term(body)
+            self.scope.unbind(parameter for parameter, _ in parameters)
+            self.functions[name] = bv_width(sort)
+            return ['define-fun', name, [[p, replace_bv_type(s)] for p, s in parameters], replace_bv_type(sort), body]
+
+        if statement[0] == 'assert':
+            return ['assert', self.term(statement[1])[0]]
+
+        return statement
+
+
+def rewrite(commands, bounded=True, metadata=None):
+    # Only the helpers for the operations and widths in use are emitted, each right before
+    # the first command that needs it, so the input is rewritten in a single streaming pass.
+    # Only options and info may precede the logic, so a missing one is set before any other command.
+    rewriter = BVRewriter(bounded, metadata)
+    has_set_logic, added_set_logic = False, False
+    for statement in commands:
+        if statement[0] == 'set-logic':
+            if added_set_logic:
+                continue
+            has_set_logic = True
+        elif not has_set_logic and statement[0] not in ('set-info', 'set-option'):
+            yield ['set-logic', 'HORN']
+            has_set_logic, added_set_logic = True, True
+
+        statement = rewriter.statement(statement)
+        yield from rewriter.definitions()
+        yield statement
+
+def restore(commands, metadata):
+    # Every BitVec parameter is rebound to its Int value around the interpretation,
+    # which is exact since the int processors represent a BitVec value by its unsigned value
+    signatures = metadata.get('signatures', dict())
+    for statement in commands:
+        signature = signatures.get(unquote(statement[1])) if statement[0] == 'define-fun' else None
+        if signature is None or len(signature) != len(statement[2]) + 1:
+            yield statement
+            continue
+
+        _, name, parameters, _, body = statement
+        bindings = [[parameter, ['bv2nat', parameter]]
+                    for (parameter, _), sort in zip(parameters, signature) if is_bv_type(sort)]
+        if bindings:
+            body = ['let', bindings, body]
+        if is_bv_type(signature[-1]):
+            body = [['_', 'int2bv', signature[-1][2]], body]
+        yield ['define-fun', name, [[parameter, sort] for (parameter, _), sort in zip(parameters, signature)],
+               signature[-1], body]
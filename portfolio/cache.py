@@ -0,0 +1,156 @@
+import json
+import os
+import re
+
+from contextlib import contextmanager
+from fcntl import flock, LOCK_EX, LOCK_UN
+from hashlib import sha256
+from tempfile import mkstemp as make_tempfile
+from time import time, time_ns
+
+from portfolio.configurations import engine_of
+from portfolio.sexp import iter_commands, serialize
+
+
+PORTFOLIO_IMPORT = re.compile(r'^from portfolio\.(\w+) import', re.MULTILINE)
+
+
+def engine_fingerprint(engines_path, engine):
+    # Any change to a runner or to the binaries next to it invalidates the cached results
+    digest = sha256()
+    for path in sorted(engines_path.joinpath(engine).rglob('*')):
+        if path.is_file() and '__pycache__' not in path.parts:
+            stat = path.stat()
+            digest.update(f'{path.relative_to(engines_path)}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+def processor_fingerprint(processors_path, processor):
+    # Any change to the steps of a processor, in any format, or to the portfolio modules they import,
+    # directly or through other portfolio modules, invalidates the cached results
+    package_path = processors_path.parent.joinpath('portfolio')
+    pending, sources = sorted(processors_path.glob(f'*/{processor}/*.py')), set()
+    while pending:
+        path = pending.pop()
+        if path in sources or not path.is_file():
+            continue
+        sources.add(path)
+        pending.extend(package_path.joinpath(f'{module}.py') for module in PORTFOLIO_IMPORT.findall(path.read_text()))
+
+    digest = sha256()
+    for path in sorted(sources):
+        stat = path.stat()
+        digest.update(f'{path.relative_to(processors_path.parent)}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+def problem_key(input_file, engines, args):
+    digest = sha256()
+    digest.update(f'format:{args.format}\n'.encode())
+    for engine in sorted(engines):
+        digest.update(f'engine:{engine}:{engine_fingerprint(args.engines_path, engine_of(engine))}\n'.encode())
+        for processor in args.process.get(engine, []):
+            digest.update(f'process:{processor}:{processor_fingerprint(args.processors_path, processor)}\n'.encode())
+
+    # Comments and whitespace are dropped by the parser, and (get-model) does not change the answer
+    for statement in iter_commands(input_file):
+        if statement != ['get-model']:
+            digest.update(serialize(statement).encode('utf-8'))
+            digest.update(b'\n')
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, path, max_size, max_age, logger):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.logger = logger
+
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def entry_path(self, key):
+        return self.path.joinpath(key[:2]).joinpath(f'{key}.json')
+
+    @contextmanager
+    def locked(self):
+        with open(self.path.joinpath('.lock'), 'a') as lock_handle:
+            flock(lock_handle, LOCK_EX)
+            try:
+                yield
+            finally:
+                flock(lock_handle, LOCK_UN)
+
+    def count(self, counter, amount=1):
+        stats_path = self.path.joinpath('stats.json')
+        with self.locked():
+            try:
+                stats = json.loads(stats_path.read_text())
+            except (OSError, ValueError):
+                stats = dict()
+            stats[counter] = stats.get(counter, 0) + amount
+            self.write_atomically(stats_path, stats)
+
+    def stats(self):
+        try:
+            return json.loads(self.path.joinpath('stats.json').read_text())
+        except (OSError, ValueError):
+            return dict()
+
+    def write_atomically(self, path, content):
+        # Readers in other processes either see the previous file or the complete new one
+        path.parent.mkdir(exist_ok=True)
+        tfile_fd, tfile_path = make_tempfile(dir=path.parent, suffix='.tmp')
+        with open(tfile_fd, 'w') as tfile_handle:
+            json.dump(content, tfile_handle)
+        os.replace(tfile_path, path)
+
+    def get(self, key):
+        entry_path = self.entry_path(key)
+        try:
+            stat = entry_path.stat()
+            if time() - stat.st_mtime > self.max_age:
+                raise ValueError('expired')
+            entry = json.loads(entry_path.read_text())
+            # An entry is modified only when it is written, so a hit updates its access time alone
+            os.utime(entry_path, ns=(time_ns(), stat.st_mtime_ns))
+        except (KeyError, OSError, ValueError):
+            self.count('misses')
+            return None
+
+        self.count('hits')
+        return entry['engine'], entry['result']
+
+    def put(self, key, engine, result):
+        self.write_atomically(self.entry_path(key), {
+            'engine': engine,
+            'result': result,
+        })
+        self.evict()
+
+    def evict(self):
+        with self.locked():
+            entries = []
+            for entry_path in self.path.glob('*/*.json'):
+                try:
+                    stat = entry_path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_atime, stat.st_mtime, stat.st_size, entry_path))
+
+            # The age of an entry counts from when it was written, as in get, but the least recently used
+            # entries are evicted first to stay within the size limit
+            entries.sort()
+            total_size = sum(size for _, _, size, _ in entries)
+            evicted = 0
+            for _, written, size, entry_path in entries:
+                if total_size <= self.max_size and time() - written <= self.max_age:
+                    continue
+                try:
+                    entry_path.unlink()
+                except OSError:
+                    continue
+                total_size -= size
+                evicted += 1
+
+        if evicted:
+            self.logger.debug(f'Evicted {evicted} cached result(s).')
+            self.count('evictions', evicted)
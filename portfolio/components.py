@@ -0,0 +1,97 @@
+from pathlib import Path
+from tempfile import mkstemp as make_tempfile
+
+from portfolio.sexp import iter_commands, serialize, unquote
+
+
+def is_predicate(statement):
+    return statement[0] == 'declare-fun' and len(statement) == 4 and statement[3] == 'Bool'
+
+def clause_predicates(term, predicates):
+    # Any occurrence counts, even a shadowed one, as merging two components is always sound
+    found, stack = set(), [term]
+    while stack:
+        term = stack.pop()
+        if type(term) is list:
+            stack.extend(term)
+        elif unquote(term) in predicates:
+            found.add(unquote(term))
+    return found
+
+def is_query(term, predicates):
+    # Only clauses with a predicate as their head are rules, anything else must be checked by an engine
+    while type(term) is list and len(term) == 3 and term[0] == 'forall':
+        term = term[2]
+    head = term[-1] if type(term) is list and term and term[0] == '=>' else term
+    name = head[0] if type(head) is list and head else head
+    return not (type(name) is str and unquote(name) in predicates)
+
+def true_definition(declaration):
+    parameters = [[f'x!{i}', sort] for i, sort in enumerate(declaration[2])]
+    return serialize(['define-fun', declaration[1], parameters, 'Bool', 'true'])
+
+def decompose(input_file, directory):
+    # Clauses that share no predicate, directly or through other clauses, form independent systems: the whole
+    # system is satisfiable exactly when each of them is, and the union of their models is a model of it.
+    # Systems without a query are satisfied by interpreting all of their predicates as true.
+    statements = list(iter_commands(input_file))
+    predicates = {unquote(s[1]): s for s in statements if is_predicate(s)}
+
+    roots = {predicate: predicate for predicate in predicates}
+    def find(predicate):
+        while roots[predicate] != predicate:
+            roots[predicate] = roots[roots[predicate]]
+            predicate = roots[predicate]
+        return predicate
+
+    clauses = dict()
+    for index, statement in enumerate(statements):
+        if statement[0] != 'assert':
+            continue
+        found = clause_predicates(statement[1], predicates)
+        for predicate in found:
+            roots[find(predicate)] = find(next(iter(found)))
+        clauses[index] = found
+
+    components, queries, constraints = dict(), set(), []
+    for index, found in clauses.items():
+        if not found:
+            constraints.append(index)
+            continue
+        component = find(next(iter(found)))
+        components.setdefault(component, []).append(index)
+        if is_query(statements[index][1], predicates):
+            queries.add(component)
+
+    solved = [component for component in components if component in queries]
+    trivial = [declaration for predicate, declaration in predicates.items()
+               if find(predicate) not in queries]
+    if not solved or (len(solved) == 1 and not trivial):
+        return None
+    # A clause without predicates has an empty model, which engines do not report as a solution, so it is
+    # checked along with the first component instead of on its own
+    components[solved[0]].extend(constraints)
+
+    assignment = {index: component for component, indices in components.items() for index in indices}
+    handles, paths = dict(), []
+    try:
+        for component in solved:
+            tfile_fd, tfile_path = make_tempfile(dir=directory, suffix=Path(input_file).suffix)
+            handles[component] = open(tfile_fd, 'w')
+            paths.append(tfile_path)
+
+        # Everything but the clauses and the predicates is repeated in each component, in its original place
+        for index, statement in enumerate(statements):
+            if statement[0] == 'assert':
+                targets = [assignment[index]] if assignment[index] in handles else []
+            elif is_predicate(statement):
+                targets = [find(unquote(statement[1]))] if find(unquote(statement[1])) in handles else []
+            else:
+                targets = handles
+            for target in targets:
+                handles[target].write(serialize(statement) + '\n')
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+    return paths, [true_definition(declaration) for declaration in trivial]
@@ -0,0 +1,33 @@
+from fnmatch import fnmatchcase
+from importlib import import_module
+
+
+def engine_of(configuration):
+    # The default configuration of an engine is named after the engine, the others are <engine>/<name>
+    return configuration.partition('/')[0]
+
+def detect_configurations(engines, logger):
+    # Runners may declare named configurations besides their default one, each with the options it adds
+    # to the command line and a priority, so that the lower values are started first
+    priorities = dict()
+    for engine in engines:
+        priorities[engine] = 0
+        try:
+            declared = getattr(import_module(f'engines.{engine}.runner'), 'CONFIGURATIONS', dict())
+        except Exception as e:
+            logger.warning(f'Could not load the configurations of "{engine}" engine: {e}')
+            continue
+        for name, configuration in declared.items():
+            priorities[f'{engine}/{name}'] = configuration.get('priority', 0)
+    return priorities
+
+def select(pattern, configurations):
+    # Flags name configurations or match them with shell-style wildcards, so "z3-spacer" is only the
+    # default configuration of z3-spacer, while "z3-spacer*" includes all of them
+    return [configuration for configuration in configurations if fnmatchcase(configuration, pattern)]
+
+def configuration_options(runner, configuration):
+    _, _, name = configuration.partition('/')
+    if not name:
+        return []
+    return list(getattr(runner, 'CONFIGURATIONS', dict())[name].get('options', []))
@@ -0,0 +1,322 @@
+import asyncio
+import os
+import signal
+
+from functools import partial
+from importlib import import_module
+from pathlib import Path
+from time import monotonic
+
+from portfolio import telemetry
+from portfolio.configurations import configuration_options, engine_of
+from portfolio.hints import conjoin, LemmaTrace, strengthen
+from portfolio.limits import apply_budget, describe_budget, engine_cgroup, exhausted_by_children, exhausted_by_exit
+from portfolio.output import EngineCommand, in_thread
+from portfolio.preprocess import is_direct, postprocess, virtual_input
+from portfolio.process import GroupUsage, signal_group, stop_groups
+
+
+USAGE_INTERVAL = 0.1
+
+
+class Execution:
+    # The portfolio reaches an engine through its process group, which is only known once the engine has started
+    def __init__(self):
+        self.pid = None
+        self.worker = None
+        self.node = None
+        self.job = None
+        self.cpus = None
+        self.future = None
+        self.stopped = False
+        self.started = monotonic()
+
+
+def engine_logger(engine, args):
+    logger = args.logging.getLogger(f'e:{engine}')
+    logger.setLevel(args.logging.getLevelName(args.log_level))
+    return logger
+
+def load_runner(engine, args, logger):
+    engine_path = args.engines_path.joinpath(engine_of(engine))
+    if not engine_path.is_dir():
+        logger.critical(f'Failed to locate "{engine}" engine at "{engine_path}"!')
+        return None
+
+    engine_path = engine_path.joinpath('runner.py')
+    if not engine_path.is_file():
+        logger.error(f'Failed to locate "{engine}" runner at "{engine_path}"!')
+        return None
+
+    try:
+        return import_module(f'engines.{engine_of(engine)}.runner')
+    except Exception as e:
+        logger.error(f'Engine "{engine}" runner could not be loaded!')
+        logger.exception(e)
+        return None
+
+def prepare(runner, engine, args, logger):
+    try:
+        with telemetry.span('setup', 'engine', engine=engine):
+            runner.setup(args)
+    except Exception as e:
+        logger.error(f'Engine "{engine}" could not be setup!')
+        logger.exception(e)
+        return None
+
+    if hasattr(runner, 'preprocess'):
+        try:
+            logger.debug(f'Preprocessing "{args.input_file}" for "{engine}" engine ...')
+            with telemetry.span('preprocess', 'engine', engine=engine):
+                args = runner.preprocess(args)
+            logger.info(f'Input preprocessing is complete.')
+        except Exception as e:
+            logger.error(f'Exception encountered during input preprocessing:')
+            logger.exception(e)
+            return None
+
+    return args
+
+def complete(result, args, logger, hints=None):
+    if hints:
+        try:
+            result = conjoin(result, hints)
+        except Exception as e:
+            logger.error(f'Exception encountered while conjoining the hints to the solution:')
+            logger.exception(e)
+            return 'FAIL'
+
+    if args.post_steps:
+        try:
+            logger.debug(f'Postprocessing the solution with {len(args.post_steps)} step(s) ...')
+            with telemetry.span('postprocess', 'engine'):
+                result = postprocess(result, args.post_steps, args)
+        except Exception as e:
+            logger.error(f'Exception encountered during solution postprocessing:')
+            logger.exception(e)
+            return 'FAIL'
+
+    logger.debug(f'A solution was found:\n{result}')
+    return result
+
+def run_engine_process(task, args, channel):
+    _, engine = task
+
+    # All processes spawned by the engine inherit this process group,
+    # so the portfolio can stop the entire tree with a single signal
+    os.setsid()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if args.cpus:
+        os.sched_setaffinity(0, args.cpus)
+
+    # Spans recorded in this process are reported together with the result
+    telemetry.reset(f'e:{engine}')
+    report = lambda result: channel.send((task, result, telemetry.collect()))
+
+    logger = engine_logger(engine, args)
+
+    budget = args.budgets.get(engine, dict())
+    cgroup = apply_budget(budget)
+    if budget:
+        logger.debug(f'Enforcing a budget of {describe_budget(budget)}'
+                     f'{f" in cgroup {cgroup}" if cgroup else ""}.')
+
+    engine_runner = load_runner(engine, args, logger)
+    args = engine_runner and prepare(engine_runner, engine, args, logger)
+    if not args:
+        report('FAIL')
+        return
+
+    logger.debug(f'Starting solver: {engine}("{args.input_file}").')
+    try:
+        with telemetry.span('solve', 'engine', input=str(args.input_file)):
+            result = engine_runner.solve(args)
+    except Exception as e:
+        logger.error(f'Exception encountered during solving:')
+        logger.exception(e)
+        result = None
+
+    if result:
+        report(complete(result, args, logger))
+        return
+
+    exhausted = exhausted_by_children(budget, cgroup)
+    if exhausted:
+        logger.warning(f'Solver exhausted its {exhausted} budget.')
+        report('EXHAUSTED')
+    else:
+        report('FAIL')
+
+async def readable(connection):
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    loop.add_reader(connection.fileno(), lambda: ready.done() or ready.set_result(None))
+    try:
+        await ready
+    finally:
+        loop.remove_reader(connection.fileno())
+
+async def run_worker(task, args, execution):
+    # Only runners without a command need a worker, so multiprocessing is not loaded for the others
+    from multiprocessing import Pipe, Process
+
+    receiver, sender = Pipe(duplex=False)
+    execution.worker = Process(target=run_engine_process, args=(task, args, sender))
+    execution.worker.start()
+    execution.pid = execution.worker.pid
+    sender.close()
+
+    try:
+        await readable(receiver)
+        _, result, spans = receiver.recv()
+        telemetry.spans.extend(spans)
+    except EOFError:
+        result = 'FAIL'
+    finally:
+        receiver.close()
+
+    await in_thread(execution.worker.join)
+    return result
+
+async def watch_usage(usage):
+    # The members of a group are gone once they are reaped, so the usage of an engine is sampled while it runs.
+    # CPU time of the processes it already reaped is included in theirs.
+    while usage.update() and usage.survivors:
+        await asyncio.sleep(USAGE_INTERVAL)
+
+async def run_command(task, runner, args, execution):
+    _, engine = task
+    logger = engine_logger(engine, args)
+
+    args = await in_thread(prepare, runner, engine, args, logger)
+    if not args or execution.stopped:
+        return 'FAIL'
+
+    budget = args.budgets.get(engine, dict())
+    if budget:
+        logger.debug(f'Enforcing a budget of {describe_budget(budget)}.')
+
+    # With --share-hints, engines that accept hints start from their input strengthened with the ones shared so far,
+    # and engines that learn lemmas publish them from a trace
+    store, hints, trace = getattr(args, 'hints', None), dict(), None
+    if store and getattr(runner, 'HINTS', False) and store.hints:
+        try:
+            with telemetry.span('hints', 'engine', engine=engine):
+                hints = store.hints
+                args.input_file = Path(await in_thread(strengthen, args.input_file, hints, args))
+            logger.debug(f'Strengthened the input with hints for {len(hints)} predicate(s).')
+        except Exception as e:
+            logger.warning(f'Could not apply the shared hints: {e}')
+            hints = dict()
+    if store and hasattr(runner, 'lemmas'):
+        try:
+            trace = LemmaTrace(args.temp_path, logger)
+        except OSError as e:
+            logger.warning(f'Could not set up the lemma trace of "{engine}" engine: {e}')
+        else:
+            # Engines that trace are started in the directory of the trace, so runners can name it without a path
+            args.trace_path = trace.path
+            args.input_file = Path(args.input_file).resolve()
+
+    virtual = None
+    if hasattr(runner, 'GET_MODEL'):
+        try:
+            virtual = virtual_input(args.input_file, runner.GET_MODEL, args.temp_path)
+        except OSError as e:
+            logger.error(f'Could not set up the input of "{engine}" engine!')
+            logger.exception(e)
+            if trace:
+                trace.close()
+            return 'FAIL'
+        if virtual:
+            logger.debug(f'Streaming "{args.input_file}" {"with" if runner.GET_MODEL else "without"} (get-model) through "{virtual.path}".')
+            args.input_file = virtual.path
+
+    command = EngineCommand(runner.command(args), budget, args.cpus, trace and trace.path.parent)
+    logger.debug(f'Exec: {" ".join(str(c) for c in command.command)}')
+    try:
+        execution.pid = await command.start()
+    except OSError as e:
+        logger.error(f'Engine "{engine}" could not be started!')
+        logger.exception(e)
+        if virtual:
+            virtual.close()
+        if trace:
+            trace.close()
+        return 'FAIL'
+    if virtual:
+        virtual.serve()
+    if trace:
+        trace.follow(partial(runner.lemmas, args=args), store.publish)
+
+    # The engine may have been cancelled while it was being started
+    if execution.stopped:
+        signal_group(execution.pid, signal.SIGKILL)
+
+    # The portfolio's own usage covers all engines, so the span and the CPU budget use the usage of the engine's group
+    usage = GroupUsage(execution.pid)
+    watcher = asyncio.ensure_future(watch_usage(usage)) if telemetry.enabled or 'cpu' in budget else None
+    with telemetry.span('solve', 'engine', engine=engine, input=str(args.input_file)) as attributes:
+        try:
+            result = await command.answer(partial(runner.answer, args=args))
+            if watcher:
+                usage.update()
+            returncode = await command.wait()
+            if returncode != 0:
+                raise AssertionError(f'Exit code {returncode}')
+        except Exception as e:
+            returncode = await command.wait()
+            if not execution.stopped:
+                logger.error(f'Solver terminated with an error!{command.error()}')
+                logger.exception(e)
+            result = None
+        if virtual:
+            await in_thread(virtual.close)
+        if trace:
+            await in_thread(trace.close)
+        if watcher:
+            watcher.cancel()
+        if telemetry.enabled:
+            attributes.update(cpu=round(usage.cpu, 6), max_rss=usage.max_rss / 2**20)
+
+    if execution.stopped:
+        return 'FAIL'
+    if result:
+        return await in_thread(complete, result, args, logger, hints)
+
+    exhausted = exhausted_by_exit(budget, returncode, engine_cgroup(execution.pid), usage.cpu)
+    if exhausted:
+        logger.warning(f'Solver exhausted its {exhausted} budget.')
+        return 'EXHAUSTED'
+    return 'FAIL'
+
+async def run_engine(task, args, execution):
+    _, engine = task
+    logger = engine_logger(engine, args)
+    runner = load_runner(engine, args, logger)
+    if runner is None:
+        return 'FAIL'
+    try:
+        args.options = configuration_options(runner, engine)
+    except KeyError:
+        logger.error(f'Engine "{engine_of(engine)}" has no configuration "{engine}"!')
+        return 'FAIL'
+    if not is_direct(runner):
+        return await run_worker(task, args, execution)
+    return await run_command(task, runner, args, execution)
+
+async def stop_executions(executions, grace_period):
+    # Engines on other nodes are stopped by their agents, while the local groups get the grace period here
+    for execution in executions:
+        if execution.node is not None and execution.job is not None:
+            execution.node.cancel(execution.job)
+    usages = await in_thread(stop_groups, [execution.pid for execution in executions if execution.pid is not None],
+                             grace_period)
+
+    # A worker that had not yet become a group leader is not reachable via its group
+    for execution in executions:
+        if execution.worker is not None:
+            execution.worker.terminate()
+
+    await asyncio.wait([execution.future for execution in executions])
+    return usages
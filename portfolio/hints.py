@@ -0,0 +1,121 @@
+import os
+
+from pathlib import Path
+from shutil import rmtree
+from tempfile import mkdtemp, mkstemp as make_tempfile
+from threading import Lock, Thread
+
+from portfolio.sexp import iter_commands, parse, serialize, unquote
+
+
+# A hint is a lemma for a predicate: a formula over the predicate's parameters that holds for
+# every derivable fact and is inductive together with the other lemmas, like the conjuncts of a
+# past solution that are still inductive. Consumers assume hints in the clause bodies.
+
+class HintStore:
+    # Engines publish the lemmas they learn for an input as candidates, which are only shared once the portfolio
+    # has checked that they are hints for the input's clauses. Engines started later on the same input,
+    # such as the other configurations of a publisher, begin with the checked ones.
+    def __init__(self, input_file):
+        self.input_file = input_file
+        self.lock = Lock()
+        self.candidates = []
+        self.seen = set()
+        self.hints = dict()
+        self.checking = None
+
+    def publish(self, predicate, parameters, lemma):
+        key = (unquote(predicate), tuple(parameters), serialize(lemma))
+        with self.lock:
+            if key not in self.seen:
+                self.seen.add(key)
+                self.candidates.append((predicate, parameters, lemma))
+
+    def take(self, limit):
+        with self.lock:
+            candidates, self.candidates = self.candidates[:limit], self.candidates[limit:]
+        return candidates
+
+
+class LemmaTrace:
+    # The engine logs its progress into a FIFO, which is read while it is written, so a trace is never kept
+    # on disk however long the engine runs. The runner picks the lemmas out of it.
+    def __init__(self, directory, logger):
+        self.path = Path(mkdtemp(prefix='fifo-', dir=directory)).joinpath('trace')
+        os.mkfifo(self.path)
+        self.logger = logger
+        self.reader = None
+        self.closed = False
+
+    def follow(self, lemmas, publish):
+        self.reader = Thread(target=self.read, args=(lemmas, publish), daemon=True)
+        self.reader.start()
+
+    def read(self, lemmas, publish):
+        # An engine may open its trace more than once, so it is reopened until the engine has exited
+        while not self.closed:
+            with open(self.path, 'rb') as fifo_handle:
+                try:
+                    for predicate, parameters, lemma in lemmas(fifo_handle):
+                        publish(predicate, parameters, lemma)
+                except Exception as e:
+                    self.logger.warning(f'Could not read the lemmas of the engine: {e}')
+                # The engine blocks once the FIFO is full, so the rest of the trace is drained in any case
+                while fifo_handle.read(2**16):
+                    pass
+
+    def close(self):
+        # The reader waits in open() for the next time the engine opens its trace,
+        # until a writer shows up and leaves again
+        self.closed = True
+        while self.reader is not None and self.reader.is_alive():
+            try:
+                os.close(os.open(self.path, os.O_WRONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
+            self.reader.join(0.05)
+        rmtree(self.path.parent, ignore_errors=True)
+
+def instantiate(hints, args):
+    # Binding the parameters with a let keeps the lemma intact, whatever the argument terms are
+    return [['let', [[p, a] for p, a in zip(parameters, args)], lemma] if parameters else lemma
+            for parameters, lemma in hints]
+
+def strengthen_term(term, hints):
+    if type(term) is list and term and term[0] in ('forall', 'exists'):
+        return [term[0], term[1], strengthen_term(term[2], hints)]
+    if type(term) is not list or not term or term[0] != '=>':
+        return term
+
+    body = term[1:-1]
+    conjuncts = body[0][1:] if len(body) == 1 and type(body[0]) is list and body[0] and body[0][0] == 'and' else body
+    lemmas = []
+    for conjunct in conjuncts:
+        predicate, args = (conjunct[0], conjunct[1:]) if type(conjunct) is list and conjunct else (conjunct, [])
+        if type(predicate) is str and unquote(predicate) in hints:
+            lemmas.extend(instantiate(hints[unquote(predicate)], args))
+    if not lemmas:
+        return term
+    return ['=>', ['and'] + list(conjuncts) + lemmas, term[-1]]
+
+def strengthen(input_file, hints, args):
+    # Conjoining lemmas to the clause bodies keeps the least model, and so the answer, unchanged
+    tfile_fd, tfile_path = make_tempfile(dir=args.temp_path, suffix='.with-hints.smt')
+    with open(tfile_fd, 'w') as tfile_handle:
+        for statement in iter_commands(input_file):
+            if statement[0] == 'assert':
+                statement = ['assert', strengthen_term(statement[1], hints)]
+            tfile_handle.write(serialize(statement) + '\n')
+    return tfile_path
+
+def conjoin(result, hints):
+    # The lemmas are inductive, so adding them back turns a solution of the strengthened clauses
+    # into a solution of the original ones
+    definitions = []
+    for statement in parse(result):
+        if type(statement) is list and statement[0] == 'define-fun':
+            if unquote(statement[1]) in hints:
+                lemmas = instantiate(hints[unquote(statement[1])], [parameter for parameter, _ in statement[2]])
+                statement = statement[:4] + [['and', statement[4]] + lemmas]
+        definitions.append(serialize(statement))
+    return '\n'.join(definitions)
@@ -0,0 +1,116 @@
+import sqlite3
+
+from math import log
+from statistics import median
+from time import time
+
+from portfolio.sexp import iter_commands
+
+
+BV_OPERATIONS = {
+    'bvadd', 'bvsub', 'bvneg', 'bvmul', 'bvudiv', 'bvurem', 'bvsdiv', 'bvsrem', 'bvsmod',
+    'bvand', 'bvor', 'bvxor', 'bvnot', 'bvshl', 'bvlshr', 'bvashr',
+    'bvult', 'bvule', 'bvugt', 'bvuge', 'bvslt', 'bvsle', 'bvsgt', 'bvsge',
+    'concat', 'extract', 'zero_extend', 'sign_extend',
+}
+
+MIN_RUNS_TO_DEFER = 5
+
+
+def is_numeral(term):
+    return type(term) is not list and term.replace('.', '', 1).isdigit()
+
+def extract_features(input_file):
+    features = {
+        'predicates': 0, 'clauses': 0, 'max_arity': 0,
+        'bitvec': False, 'array': False, 'nonlinear': False, 'bv_ops': False,
+    }
+
+    for statement in iter_commands(input_file):
+        if statement[0] == 'declare-fun' and statement[-1] == 'Bool':
+            features['predicates'] += 1
+            features['max_arity'] = max(features['max_arity'], len(statement[2]))
+        elif statement[0] == 'assert':
+            features['clauses'] += 1
+
+        stack = [statement]
+        while stack:
+            term = stack.pop()
+            if type(term) is not list:
+                if term == 'BitVec':
+                    features['bitvec'] = True
+                elif term == 'Array':
+                    features['array'] = True
+                elif term in BV_OPERATIONS:
+                    features['bv_ops'] = True
+                continue
+
+            if term and term[0] == '*' and sum(not is_numeral(t) for t in term[1:]) > 1:
+                features['nonlinear'] = True
+            elif term and term[0] in ('div', 'mod') and len(term) > 2 and not is_numeral(term[2]):
+                features['nonlinear'] = True
+            stack.extend(term)
+
+    return features
+
+def feature_class(features):
+    # Counts are bucketed logarithmically, so similar problems share their history
+    bucket = lambda n: int(log(n + 1, 4))
+    flags = ''.join(flag for flag, key in (('B', 'bitvec'), ('A', 'array'), ('N', 'nonlinear'), ('O', 'bv_ops'))
+                    if features[key])
+    return (f'p{bucket(features["predicates"])}'
+            f'c{bucket(features["clauses"])}'
+            f'a{bucket(features["max_arity"])}'
+            f'{f"-{flags}" if flags else ""}')
+
+
+class History:
+    def __init__(self, path, logger):
+        self.logger = logger
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS runs (
+                                       class TEXT, engine TEXT, outcome TEXT, time REAL, recorded REAL)''')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS runs_by_class ON runs (class)')
+        self.connection.commit()
+
+    def classify(self, input_file):
+        features = extract_features(input_file)
+        klass = feature_class(features)
+        self.logger.debug(f'Problem features: {features} (class "{klass}").')
+        return klass
+
+    def record(self, klass, outcomes):
+        with self.connection:
+            self.connection.executemany('INSERT INTO runs VALUES (?, ?, ?, ?, ?)',
+                                        [(klass, engine, outcome, elapsed, time())
+                                         for engine, (outcome, elapsed) in outcomes.items()])
+
+    def rank(self, klass, engines):
+        stats = {engine: {'runs': 0, 'wins': 0, 'win_time': 0.0} for engine in engines}
+        for engine, outcome, runs, total_time in self.connection.execute(
+                'SELECT engine, outcome, COUNT(*), SUM(time) FROM runs WHERE class = ? GROUP BY engine, outcome',
+                (klass,)):
+            if engine not in stats:
+                continue
+            stats[engine]['runs'] += runs
+            if outcome == 'win':
+                stats[engine]['wins'] += runs
+                stats[engine]['win_time'] += total_time
+
+        # Engines are ranked by their smoothed win rate, then by their mean time to win
+        def score(engine):
+            s = stats[engine]
+            mean_win_time = s['win_time'] / s['wins'] if s['wins'] else float('inf')
+            return (-(s['wins'] + 1) / (s['runs'] + 2), mean_win_time, engines.index(engine))
+        ranked = sorted(engines, key=score)
+
+        # Engines that have never won in this class start only once the usual winners had their chance
+        win_times = [t for (t,) in self.connection.execute(
+                         'SELECT time FROM runs WHERE class = ? AND outcome = ?', (klass, 'win'))]
+        delay = median(win_times) if win_times else 0
+        delays = {engine: delay if stats[engine]['runs'] >= MIN_RUNS_TO_DEFER and not stats[engine]['wins'] else 0
+                  for engine in engines}
+
+        self.logger.debug(f'Engine ranking for class "{klass}": '
+                          f'{", ".join(f"{e} (+{delays[e]:.2f}s)" if delays[e] else e for e in ranked)}.')
+        return ranked, delays
@@ -0,0 +1,187 @@
+from hashlib import sha256
+from pathlib import Path
+from shutil import which
+from subprocess import run, TimeoutExpired
+from time import time
+
+from portfolio.cache import ResultCache
+from portfolio.components import clause_predicates, is_predicate
+from portfolio.hints import instantiate, strengthen
+from portfolio.sexp import iter_commands, parse, serialize, unquote
+from portfolio.simplify import conjuncts, normalize
+
+
+# Statements that the clauses may refer to, which are repeated before the checks
+DECLARATIONS = {'declare-sort', 'define-sort', 'declare-const', 'declare-fun', 'define-fun', 'define-fun-rec',
+                'define-funs-rec', 'declare-datatype', 'declare-datatypes'}
+
+# Milliseconds z3 gets for each check, an unknown answer counts as a failed check
+CHECK_TIMEOUT = 1000
+
+
+def solution_key(declaration):
+    # Solutions are indexed by the name and sorts of the predicate, which usually survive small changes of a program
+    return sha256(serialize([unquote(declaration[1]), declaration[2]]).encode('utf-8')).hexdigest()
+
+def checker_path(args):
+    bundled = args.engines_path.joinpath('z3-spacer').joinpath('z3')
+    return bundled if bundled.is_file() else which('z3')
+
+def check(queries, declarations, args):
+    # Every query is the negation of a formula that should be valid, checked in a single z3 process
+    script = [serialize(statement) for statement in declarations]
+    for query in queries:
+        script.append(f'(push 1)\n(assert (not {serialize(query)}))\n(check-sat)\n(pop 1)')
+    try:
+        result = run([checker_path(args), '-in', f'-t:{CHECK_TIMEOUT}'], input='\n'.join(script), capture_output=True,
+                     text=True, timeout=len(queries) * CHECK_TIMEOUT / 1000 + 5)
+    except TimeoutExpired:
+        return [False] * len(queries)
+
+    # A statement that z3 rejects is reported on a line of its own, and its check then answers sat
+    answers = [line.strip() for line in result.stdout.splitlines() if line.strip() in ('sat', 'unsat', 'unknown')]
+    if len(answers) != len(queries):
+        return [False] * len(queries)
+    return [answer == 'unsat' for answer in answers]
+
+def ordered(definitions, predicates):
+    # Definitions may refer to other predicates, so each follows the ones it uses,
+    # and those that use a predicate without a definition are left out
+    result, pending = [], dict(definitions)
+    while pending:
+        ready = [predicate for predicate, definition in pending.items()
+                 if clause_predicates(definition[4], predicates) <= set(definitions).difference(pending)]
+        if not ready:
+            break
+        for predicate in ready:
+            result.append(pending.pop(predicate))
+    return result
+
+def inductive_lemmas(statements, predicates, definitions, args):
+    # The conjuncts of the past interpretations that still follow from every rule, assuming the surviving
+    # conjuncts of the body predicates, are lemmas of the new system. Failing conjuncts are dropped until
+    # the remaining ones are inductive.
+    clauses = [normalize(statement[1], predicates) for statement in statements if statement[0] == 'assert']
+    if None in clauses:
+        return dict()
+
+    lemmas = dict()
+    for predicate, definition in definitions.items():
+        parameters = [parameter for parameter, _ in definition[2]]
+        lemmas[predicate] = [(parameters, conjunct) for conjunct in conjuncts(definition[4])
+                             if not clause_predicates(conjunct, predicates)]
+
+    declarations = [statement for statement in statements if statement[0] in DECLARATIONS]
+    rules = [clause for clause in clauses if clause.head != 'false' and unquote(head_name(clause.head)) in lemmas]
+    while True:
+        queries, candidates = [], []
+        for clause in rules:
+            body = list(clause.body)
+            for literal in clause.body:
+                name, arguments = head_name(literal), literal[1:] if type(literal) is list else []
+                if type(name) is str and unquote(name) in predicates:
+                    body.extend(instantiate(lemmas.get(unquote(name), []), arguments))
+
+            predicate = unquote(head_name(clause.head))
+            arguments = clause.head[1:] if type(clause.head) is list else []
+            for lemma in lemmas[predicate]:
+                matrix = ['=>', ['and'] + body if body else 'true', instantiate([lemma], arguments)[0]]
+                queries.append(['forall', clause.variables, matrix] if clause.variables else matrix)
+                candidates.append((predicate, lemma))
+
+        failed = [candidate for candidate, valid in zip(candidates, check(queries, declarations, args)) if not valid]
+        if not failed:
+            return {predicate: found for predicate, found in lemmas.items() if found}
+        for predicate, lemma in failed:
+            if lemma in lemmas[predicate]:
+                lemmas[predicate].remove(lemma)
+
+def head_name(term):
+    return term[0] if type(term) is list and term else term
+
+def shared_hints(input_file, hints, candidates, args):
+    # The lemmas that engines published are checked together with the hints shared so far, which are inductive
+    # on their own and so survive the check: the shared hints only ever grow
+    statements = list(iter_commands(input_file))
+    predicates = {unquote(statement[1]): statement for statement in statements if is_predicate(statement)}
+
+    definitions = dict()
+    shared = [(predicate, parameters, lemma) for predicate, lemmas in hints.items() for parameters, lemma in lemmas]
+    for predicate, parameters, lemma in shared + candidates:
+        declaration = predicates.get(unquote(predicate))
+        if declaration is None or len(declaration[2]) != len(parameters):
+            continue
+        definition = definitions.setdefault(unquote(predicate), [
+            'define-fun', declaration[1], [[parameter, sort] for parameter, sort in zip(parameters, declaration[2])],
+            'Bool', ['and']])
+        names = [parameter for parameter, _ in definition[2]]
+        definition[4].append(lemma if list(parameters) == names else instantiate([(parameters, lemma)], names)[0])
+    if not definitions:
+        return hints
+    return inductive_lemmas(statements, predicates, definitions, args)
+
+
+class InvariantStore:
+    def __init__(self, path, max_size, max_age, logger):
+        self.solutions = ResultCache(path, max_size, max_age, logger)
+        self.logger = logger
+
+    def lookup(self, input_file, args):
+        # The past interpretations either solve the input as they are, or their inductive conjuncts are returned
+        statements = list(iter_commands(input_file))
+        predicates = {unquote(statement[1]): statement for statement in statements if is_predicate(statement)}
+
+        definitions = dict()
+        for predicate, declaration in predicates.items():
+            found = self.solutions.get(solution_key(declaration))
+            if found is not None:
+                definitions[predicate] = parse(found[1])[0]
+        if not definitions:
+            return None, dict()
+
+        solution = ordered(definitions, predicates)
+        if len(solution) == len(predicates):
+            declarations = [statement for statement in statements
+                            if statement[0] in DECLARATIONS and not is_predicate(statement)] + solution
+            clauses = [statement[1] for statement in statements if statement[0] == 'assert']
+            if all(check(clauses, declarations, args)):
+                return '\n'.join(serialize(definition) for definition in solution), dict()
+
+        return None, inductive_lemmas(statements, predicates, definitions, args)
+
+    def prepare(self, input_file, args):
+        # On any failure, the engines start from the unmodified input and no lemmas are conjoined to their models
+        try:
+            started = time()
+            solution, lemmas = self.lookup(input_file, args)
+            strengthened = Path(strengthen(input_file, lemmas, args)) if solution is None and lemmas else input_file
+        except Exception as e:
+            self.logger.warning(f'Could not check the past invariants for "{input_file}": {e}')
+            return None, dict(), input_file
+
+        if solution is not None:
+            self.logger.info(f'The past invariants still solve "{input_file}" ({time() - started:.3f}s).')
+            return solution, dict(), input_file
+        if not lemmas:
+            return None, dict(), input_file
+
+        self.logger.info(f'Starting the engines with {sum(map(len, lemmas.values()))} past lemma(s)'
+                         f' for {len(lemmas)} predicate(s) ({time() - started:.3f}s).')
+        return None, lemmas, strengthened
+
+    def record(self, input_file, engine, result):
+        try:
+            predicates = {unquote(statement[1]): statement
+                          for statement in iter_commands(input_file) if is_predicate(statement)}
+            # The entries are written like the results of the cache, but evicted only once at the end
+            for statement in parse(result):
+                if type(statement) is not list or statement[0] != 'define-fun' or unquote(statement[1]) not in predicates:
+                    continue
+                entry_path = self.solutions.entry_path(solution_key(predicates[unquote(statement[1])]))
+                self.solutions.write_atomically(entry_path, {
+                    'engine': engine,
+                    'result': serialize(statement),
+                })
+            self.solutions.evict()
+        except Exception as e:
+            self.logger.warning(f'Could not record the invariants for "{input_file}": {e}')
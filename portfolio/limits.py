@@ -0,0 +1,147 @@
+import os
+import resource
+import signal
+
+from math import ceil
+from pathlib import Path
+
+from portfolio.configurations import select
+from portfolio.process import is_alive
+
+
+RESOURCES = {
+    'time': ('wall-clock seconds', float),
+    'cpu': ('CPU seconds', float),
+    'memory': ('MB of resident memory', int),
+    'files': ('open file descriptors', int),
+}
+
+CGROUP_ROOT = Path('/sys/fs/cgroup')
+
+
+def parse_budgets(flags, engines, logger):
+    budgets = {engine: dict() for engine in engines}
+    for kind, (description, convert) in RESOURCES.items():
+        # Global budgets are applied first, so per-engine budgets always take precedence,
+        # and a later pattern overrides an earlier one for the configurations they both match
+        for flag in sorted(flags.get(kind) or [], key=lambda f: ':' in f):
+            pattern, _, value = flag.rpartition(':')
+            try:
+                value = convert(value)
+                if value <= 0:
+                    raise ValueError(value)
+            except ValueError:
+                logger.warning(f'Ignoring invalid {kind} budget: {flag}!')
+                continue
+            matched = select(pattern, budgets) if pattern else list(budgets)
+            if not matched:
+                logger.warning(f'Ignoring {kind} budget "{flag}" for disabled engine "{pattern}".')
+            for engine in matched:
+                budgets[engine][kind] = value
+    return budgets
+
+def describe_budget(budget):
+    return ', '.join(f'{value} {RESOURCES[kind][0]}' for kind, value in budget.items())
+
+def cgroup_name(pid):
+    return f'portfolio.{pid}'
+
+def own_cgroup():
+    try:
+        with open('/proc/self/cgroup') as cgroup_handle:
+            for line in cgroup_handle:
+                if line.startswith('0::'):
+                    return CGROUP_ROOT.joinpath(line[3:].strip().lstrip('/'))
+    except OSError:
+        pass
+    return None
+
+def enter_cgroup(budget, pid=0):
+    parent = own_cgroup()
+    if parent is None or not parent.joinpath('cgroup.controllers').is_file():
+        return None
+
+    try:
+        subtree_control = parent.joinpath('cgroup.subtree_control')
+        if 'memory' not in subtree_control.read_text().split():
+            subtree_control.write_text('+memory')
+
+        cgroup = parent.joinpath(cgroup_name(pid or os.getpid()))
+        cgroup.mkdir()
+        cgroup.joinpath('memory.max').write_text(str(budget['memory'] * 1024 * 1024))
+        if cgroup.joinpath('memory.swap.max').is_file():
+            cgroup.joinpath('memory.swap.max').write_text('0')
+        cgroup.joinpath('cgroup.procs').write_text(str(pid))
+        return cgroup
+    except OSError:
+        return None
+
+def engine_cgroup(pid):
+    parent = own_cgroup()
+    if parent is None or not parent.joinpath(cgroup_name(pid)).is_dir():
+        return None
+    return parent.joinpath(cgroup_name(pid))
+
+def release_cgroup(pid):
+    parent = own_cgroup()
+    if parent is None:
+        return
+    try:
+        parent.joinpath(cgroup_name(pid)).rmdir()
+    except OSError:
+        pass
+
+def apply_budget(budget, pid=0):
+    # The limits apply to the given process, or to this one for pid 0, and are inherited by its new children.
+    # The portfolio enforces the CPU budget over the whole process group,
+    # so the per-process rlimit is only a backstop and kicks in slightly later
+    if 'cpu' in budget:
+        limit = ceil(budget['cpu']) + 1
+        resource.prlimit(pid, resource.RLIMIT_CPU, (limit, limit + 1))
+
+    if 'files' in budget:
+        _, hard = resource.prlimit(pid, resource.RLIMIT_NOFILE)
+        limit = budget['files'] if hard == resource.RLIM_INFINITY else min(budget['files'], hard)
+        resource.prlimit(pid, resource.RLIMIT_NOFILE, (limit, hard))
+
+    if 'memory' in budget:
+        return enter_cgroup(budget, pid)
+    return None
+
+def oom_killed(cgroup):
+    if cgroup is None:
+        return False
+    try:
+        events = dict(line.split() for line in cgroup.joinpath('memory.events').read_text().splitlines())
+        return int(events.get('oom_kill', 0)) > 0
+    except (OSError, ValueError):
+        return False
+
+def exhausted_by_children(budget, cgroup):
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if 'cpu' in budget and usage.ru_utime + usage.ru_stime >= budget['cpu']:
+        return 'cpu'
+
+    if 'memory' in budget:
+        if usage.ru_maxrss >= budget['memory'] * 1024 or oom_killed(cgroup):
+            return 'memory'
+    return None
+
+def exhausted_by_exit(budget, returncode, cgroup, cpu):
+    # Engines started without a worker share the children usage of the portfolio, so the CPU time sampled
+    # from the engine's group tells whether the signal that ended it came from its CPU limit
+    if 'memory' in budget and oom_killed(cgroup):
+        return 'memory'
+    if 'cpu' in budget and returncode in (-signal.SIGXCPU, -signal.SIGKILL) and cpu >= budget['cpu']:
+        return 'cpu'
+    return None
+
+def exhausted_by_group(budget, elapsed, members):
+    if 'time' in budget and elapsed >= budget['time']:
+        return 'time'
+    if 'cpu' in budget and sum(stat['cpu'] for stat in members.values()) >= budget['cpu']:
+        return 'cpu'
+    if 'memory' in budget and sum(stat['rss'] for stat in members.values()
+                                  if is_alive(stat)) >= budget['memory'] * 1024 * 1024:
+        return 'memory'
+    return None
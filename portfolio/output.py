@@ -0,0 +1,147 @@
+import asyncio
+import os
+import signal
+
+from asyncio.subprocess import PIPE
+from threading import Thread
+
+from portfolio.limits import apply_budget
+from portfolio.process import signal_group
+
+
+STDERR_LIMIT = 64 * 2**10
+
+# Holds the engine until a line arrives on its stdin, and then replaces itself with the engine
+GATE = ['/bin/sh', '-c', 'read -r _; exec "$@"', 'engine']
+
+
+class RingBuffer:
+    # Only the last `limit` bytes are kept, so a chatty engine cannot exhaust the memory
+    def __init__(self, limit):
+        self.limit = limit
+        self.data = bytearray()
+        self.dropped = 0
+
+    def write(self, chunk):
+        self.data += chunk
+        if len(self.data) > 2 * self.limit:
+            self.dropped += len(self.data) - self.limit
+            del self.data[:len(self.data) - self.limit]
+
+    def text(self):
+        data = self.data[-self.limit:]
+        dropped = self.dropped + len(self.data) - len(data)
+        text = data.decode('utf-8', errors='replace').strip()
+        return f'[{dropped} bytes dropped]\n{text}' if dropped else text
+
+
+class OutputStream:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def status(self):
+        # The answer is the first non-empty line, which is available long before the model is complete
+        for line in self.stream:
+            line = line.strip()
+            if line:
+                return line.decode('utf-8', errors='replace')
+        return None
+
+    def lines(self):
+        yield from self.stream
+
+
+def in_thread(function, *args):
+    # Every engine gets its own thread, as a bounded pool could run out of threads
+    # while all of them are blocked on engines that are still printing
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(method, value):
+        if not future.done():
+            method(value)
+
+    def target():
+        try:
+            result = function(*args)
+        except BaseException as e:
+            loop.call_soon_threadsafe(settle, future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(settle, future.set_result, result)
+
+    Thread(target=target, daemon=True).start()
+    return future
+
+
+class EngineCommand:
+    # The engine binary is a direct child of the portfolio: the event loop drains stderr into a ring buffer
+    # and waits for the exit, while the runner parses stdout in a thread as the model arrives
+    def __init__(self, command, budget=None, cpus=None, cwd=None, stderr_limit=STDERR_LIMIT):
+        self.command = command
+        self.budget = budget
+        self.cpus = cpus
+        self.cwd = cwd
+        self.stderr = RingBuffer(stderr_limit)
+        self.process = None
+        self.stdout = None
+        self.drainer = None
+
+    async def start(self):
+        # A plain pipe keeps stdout readable with blocking calls, which the runners' parsers expect
+        read_fd, write_fd = os.pipe()
+
+        # The child of a threaded process must not run Python code before it execs, so the limits and the CPUs
+        # are applied from here, while the gate holds the engine back. Everything it starts inherits them.
+        confined = self.budget or self.cpus
+        gate_read, gate_write = os.pipe() if confined else (None, None)
+        try:
+            # The engine leads a new process group, so the portfolio can stop its entire tree with a single signal
+            self.process = await asyncio.create_subprocess_exec(
+                *(GATE if confined else []), *self.command,
+                stdin=gate_read, stdout=write_fd, stderr=PIPE, cwd=self.cwd, start_new_session=True)
+            if confined:
+                self.confine()
+                os.write(gate_write, b'\n')
+        except BaseException:
+            if self.process is not None:
+                signal_group(self.process.pid, signal.SIGKILL)
+                await self.process.wait()
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+            if confined:
+                os.close(gate_read)
+                os.close(gate_write)
+
+        self.stdout = open(read_fd, 'rb')
+        self.drainer = asyncio.ensure_future(self.drain())
+        return self.process.pid
+
+    def confine(self):
+        if self.cpus:
+            os.sched_setaffinity(self.process.pid, self.cpus)
+        if self.budget:
+            apply_budget(self.budget, self.process.pid)
+
+    async def drain(self):
+        while chunk := await self.process.stderr.read(2**16):
+            self.stderr.write(chunk)
+
+    async def answer(self, parse):
+        try:
+            return await in_thread(parse, OutputStream(self.stdout))
+        finally:
+            # Closing stdout stops an engine whose remaining output is not needed
+            self.stdout.close()
+
+    async def wait(self):
+        if not self.stdout.closed:
+            self.stdout.close()
+        returncode = await self.process.wait()
+        await self.drainer
+        return returncode
+
+    def error(self):
+        error = self.stderr.text()
+        return f'\nSTDERR:\n{error}' if error else ''
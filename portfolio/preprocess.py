@@ -0,0 +1,286 @@
+import os
+import re
+
+from concurrent.futures import Future
+from contextlib import contextmanager
+from importlib import import_module
+from importlib.util import module_from_spec, spec_from_file_location
+from mmap import ACCESS_READ, mmap
+from os.path import getsize
+from pathlib import Path
+from shutil import rmtree
+from subprocess import PIPE, run
+from tempfile import mkdtemp, mkstemp as make_tempfile
+from threading import Thread
+
+from portfolio import telemetry
+from portfolio.configurations import engine_of
+from portfolio.sexp import iter_commands, scan_commands, serialize
+
+
+GET_MODEL = re.compile(rb'\(\s*get-model\s*\)')
+MODEL_REQUEST = b'\n(get-model)\n'
+
+processor_modules = dict()
+
+
+def processor_path(args, fmt, processor, step='pre'):
+    return args.processors_path.joinpath(fmt).joinpath(processor).joinpath(f'{step}.py')
+
+def load_processor(path):
+    # Processors that expose a transform(commands, metadata) function are run in-process,
+    # any other script is executed in a subprocess instead
+    if path not in processor_modules:
+        module = None
+        try:
+            spec = spec_from_file_location(f'processors.{path.parent.parent.name}.{path.parent.name}.{path.stem}', path)
+            module = module_from_spec(spec)
+            spec.loader.exec_module(module)
+        except Exception:
+            module = None
+        processor_modules[path] = module if hasattr(module, 'transform') else None
+    return processor_modules[path]
+
+def is_direct(runner):
+    # A runner that only wraps a binary declares its command and how to read the answer,
+    # so the portfolio starts the binary itself instead of a worker process
+    return hasattr(runner, 'command') and hasattr(runner, 'answer')
+
+def engine_stages(engine, args):
+    runner = import_module(f'engines.{engine_of(engine)}.runner')
+
+    stages = []
+    if args.format != runner.FORMAT:
+        stages.append(('translate', args.format, runner.FORMAT))
+
+    # Consecutive in-process processors form a single stage, so they are chained in memory
+    plugins = []
+    for processor in args.process.get(engine, []):
+        if load_processor(processor_path(args, runner.FORMAT, processor)) is not None:
+            plugins.append(processor)
+            continue
+        if plugins:
+            stages.append(('transform', runner.FORMAT, tuple(plugins)))
+            plugins = []
+        stages.append(('process', runner.FORMAT, processor))
+    if plugins:
+        stages.append(('transform', runner.FORMAT, tuple(plugins)))
+
+    # Engines started directly read the (get-model) edit from a virtual input instead
+    if hasattr(runner, 'GET_MODEL') and not is_direct(runner):
+        stages.append(('get-model', runner.GET_MODEL))
+    return tuple(stages)
+
+def describe_stage(stage):
+    if stage[0] == 'translate':
+        return f'translate:{stage[1]}-to-{stage[2]}'
+    if stage[0] == 'process':
+        return f'process:{stage[2]}'
+    if stage[0] == 'transform':
+        return f'transform:{"+".join(stage[2])}'
+    return f'get-model:{"add" if stage[1] else "remove"}'
+
+def run_script(script, input_file, args, suffix):
+    if not script.is_file():
+        raise FileNotFoundError(script)
+
+    tfile_fd, tfile_path = make_tempfile(dir=args.temp_path, suffix=suffix)
+    with open(tfile_fd, 'wb') as tfile_handle:
+        result = run(['python3', script, input_file], stdout=tfile_handle, stderr=PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f'"{script}" failed with exit code {result.returncode}:\n'
+                           f'{result.stderr.decode("utf-8").strip()}')
+    return tfile_path
+
+@contextmanager
+def mapped(input_file):
+    if getsize(input_file) == 0:
+        yield b''
+        return
+    with open(input_file, 'rb', 0) as file:
+        with mmap(file.fileno(), 0, access=ACCESS_READ) as data:
+            yield data
+
+def has_get_model(input_file):
+    with mapped(input_file) as data:
+        return GET_MODEL.search(data) is not None
+
+def model_request_edit(data, get_model):
+    # The edit is given as the segments of the original data that are kept, followed by the bytes to append
+    spans = [match.span() for match in GET_MODEL.finditer(data)]
+    if get_model == bool(spans):
+        return None
+    if get_model:
+        return [(0, len(data))], MODEL_REQUEST
+
+    segments, start = [], 0
+    for begin, end in spans:
+        segments.append((start, begin))
+        start = end
+    segments.append((start, len(data)))
+    return segments, b''
+
+def write_edit(target, data, edit):
+    segments, tail = edit
+    with memoryview(data) as view:
+        for start, end in segments:
+            target.write(view[start:end])
+    target.write(tail)
+
+class VirtualInput:
+    # The edited input is streamed to the engine through a FIFO, straight from a mapping of the original file,
+    # so its content is never duplicated on disk. The FIFO keeps the file name, for engines that check it.
+    def __init__(self, input_file, edit, directory):
+        self.input_file = input_file
+        self.edit = edit
+        self.path = Path(mkdtemp(prefix='fifo-', dir=directory)).joinpath(Path(input_file).name)
+        os.mkfifo(self.path)
+        self.writer = None
+
+    def serve(self):
+        self.writer = Thread(target=self.write, daemon=True)
+        self.writer.start()
+
+    def write(self):
+        try:
+            with open(self.path, 'wb') as fifo_handle, mapped(self.input_file) as data:
+                write_edit(fifo_handle, data, self.edit)
+        except BrokenPipeError:
+            # The engine stopped reading its input, which it reports itself
+            pass
+
+    def close(self):
+        # An engine that exits without opening its input leaves the writer blocked in open(),
+        # until a reader shows up and leaves again
+        while self.writer is not None and self.writer.is_alive():
+            try:
+                os.close(os.open(self.path, os.O_RDONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
+            self.writer.join(0.05)
+        rmtree(self.path.parent, ignore_errors=True)
+
+def virtual_input(input_file, get_model, directory):
+    with mapped(input_file) as data:
+        edit = model_request_edit(data, get_model)
+    return None if edit is None else VirtualInput(input_file, edit, directory)
+
+def apply_stage(stage, input_file, args, metadata=None):
+    if stage[0] == 'translate':
+        _, source, target = stage
+        translator = args.translators_path.joinpath(f'{source}-to-{target}.py')
+        return run_script(translator, input_file, args, f'.from-{source}.{target}')
+
+    if stage[0] == 'process':
+        _, fmt, processor = stage
+        return run_script(processor_path(args, fmt, processor), input_file, args, f'.{processor}.pre.{fmt}')
+
+    if stage[0] == 'transform':
+        _, fmt, processors = stage
+        metadata = dict() if metadata is None else metadata
+        commands = iter_commands(input_file)
+        for processor in processors:
+            metadata[processor] = dict()
+            commands = load_processor(processor_path(args, fmt, processor)).transform(commands, metadata[processor])
+
+        tfile_fd, tfile_path = make_tempfile(dir=args.temp_path, suffix=f'.{"+".join(processors)}.pre.{fmt}')
+        with open(tfile_fd, 'w') as tfile_handle:
+            tfile_handle.writelines(serialize(statement) + '\n' for statement in commands)
+        return tfile_path
+
+    # Runners with a worker may read their input in Python, so they are given an edited copy
+    with mapped(input_file) as data:
+        edit = model_request_edit(data, stage[1])
+        if edit is None:
+            return input_file
+
+        tfile_fd, tfile_path = make_tempfile(dir=args.temp_path, suffix=f'.{"with" if stage[1] else "without"}-get-model.smt')
+        with open(tfile_fd, 'wb') as tfile_handle:
+            write_edit(tfile_handle, data, edit)
+    return tfile_path
+
+def postprocess(output, steps, args):
+    # The post-steps undo the processors in reverse order. Consecutive in-process post-steps
+    # are chained in memory, so the output is only serialized once at the end.
+    commands = None
+    for fmt, processor, metadata in steps:
+        path = processor_path(args, fmt, processor, 'post')
+        module = load_processor(path)
+        if module is not None:
+            commands = module.transform(scan_commands(output.encode('utf-8')) if commands is None else commands, metadata)
+            continue
+        if not path.is_file():
+            continue
+
+        if commands is not None:
+            output, commands = '\n'.join(serialize(statement) for statement in commands), None
+        tfile_fd, tfile_path = make_tempfile(dir=args.temp_path, suffix=f'.{processor}.post.{fmt}')
+        with open(tfile_fd, 'w') as tfile_handle:
+            tfile_handle.write(output)
+        with open(run_script(path, tfile_path, args, f'.{processor}.post.{fmt}'), 'r') as result_handle:
+            output = result_handle.read().strip()
+
+    if commands is not None:
+        output = '\n'.join(serialize(statement) for statement in commands)
+    return output
+
+
+class Pipeline:
+    def __init__(self, args, logger, executor, root=None):
+        self.args = args
+        self.logger = logger
+        self.executor = executor
+
+        # The stages start from the input, or from a future that resolves to the input once it is ready
+        if root is None:
+            root = Future()
+            root.set_result(args.input_file)
+        self.nodes = {(): root}
+        self.metadata = dict()
+
+    def node(self, stages):
+        # Each node is identified by the full chain of stages leading to it,
+        # so engines that need a common prefix of transformations share its artifacts
+        if stages not in self.nodes:
+            future = Future()
+            self.nodes[stages] = future
+            self.node(stages[:-1]).add_done_callback(
+                lambda parent: self.executor.submit(self.run, stages, parent, future))
+        return self.nodes[stages]
+
+    def run(self, stages, parent, future):
+        if parent.exception() is not None:
+            future.set_exception(parent.exception())
+            return
+
+        stage = stages[-1]
+        try:
+            # A stage applied to the same content yields the same artifact, even for a different instance
+            key = (self.args.workspace.digest(parent.result()), stage)
+            reused = self.args.workspace.lookup(key, self.args.temp_path)
+            if reused:
+                self.logger.debug(f'Reusing the output of preprocessing stage {describe_stage(stage)} on identical input.')
+                output, metadata = reused
+            else:
+                self.logger.debug(f'Running preprocessing stage {describe_stage(stage)} on "{parent.result()}" ...')
+                metadata = dict()
+                with telemetry.span(describe_stage(stage), 'preprocess', input=str(parent.result())):
+                    output = apply_stage(stage, parent.result(), self.args, metadata)
+                if output != parent.result():
+                    self.args.workspace.remember(key, output, metadata)
+            self.metadata[stages] = metadata
+            future.set_result(output)
+            self.logger.debug(f'Preprocessing stage {" > ".join(map(describe_stage, stages))} is complete.')
+        except Exception as e:
+            future.set_exception(e)
+
+    def post_steps(self, stages):
+        # Only processors have post-steps, each receiving the metadata its pre-step recorded
+        steps = []
+        for i, stage in enumerate(stages):
+            if stage[0] == 'process':
+                steps.append((stage[1], stage[2], dict()))
+            elif stage[0] == 'transform':
+                metadata = self.metadata.get(stages[:i + 1], dict())
+                steps.extend((stage[1], processor, metadata.get(processor, dict())) for processor in stage[2])
+        return tuple(reversed(steps))
@@ -0,0 +1,92 @@
+import os
+import signal
+
+from time import monotonic, sleep
+
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def read_stat(pid):
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as stat_handle:
+            stat = stat_handle.read()
+    except OSError:
+        return None
+
+    # The command name may contain spaces and parentheses,
+    # so the remaining fields are split after the last ')'
+    fields = stat[stat.rfind(b')') + 2:].split()
+    return {
+        'state': fields[0].decode(),
+        'pgid': int(fields[2]),
+        'cpu': sum(int(f) for f in fields[11:15]) / CLOCK_TICKS,
+        'rss': int(fields[21]) * PAGE_SIZE,
+    }
+
+def sample_group(pgid):
+    members = dict()
+    for entry in os.scandir('/proc'):
+        if not entry.name.isdigit():
+            continue
+        stat = read_stat(entry.name)
+        if stat and stat['pgid'] == pgid:
+            members[int(entry.name)] = stat
+    return members
+
+def is_alive(stat):
+    return stat['state'] not in ('Z', 'X')
+
+def signal_group(pgid, sig):
+    try:
+        os.killpg(pgid, sig)
+        return True
+    except (ProcessLookupError, PermissionError):
+        return False
+
+class GroupUsage:
+    def __init__(self, pgid):
+        self.pgid = pgid
+        self.cpu_by_pid = dict()
+        self.cpu_at_stop = 0
+        self.max_rss = 0
+        self.survivors = []
+
+    def update(self):
+        members = sample_group(self.pgid)
+        for pid, stat in members.items():
+            self.cpu_by_pid[pid] = max(stat['cpu'], self.cpu_by_pid.get(pid, 0))
+        self.survivors = [pid for pid, stat in members.items() if is_alive(stat)]
+        self.max_rss = max(self.max_rss, sum(members[pid]['rss'] for pid in self.survivors))
+        return members
+
+    @property
+    def cpu(self):
+        return sum(self.cpu_by_pid.values())
+
+def wait_for_groups(usages, timeout, poll_interval):
+    deadline = monotonic() + timeout
+    while True:
+        for usage in usages:
+            usage.update()
+        if not any(usage.survivors for usage in usages):
+            return True
+        if monotonic() >= deadline:
+            return False
+        sleep(poll_interval)
+
+def stop_groups(pgids, grace_period, poll_interval=0.05):
+    usages = [GroupUsage(pgid) for pgid in pgids]
+    for usage in usages:
+        usage.update()
+        usage.cpu_at_stop = usage.cpu
+        signal_group(usage.pgid, signal.SIGTERM)
+
+    if not wait_for_groups(usages, grace_period, poll_interval):
+        for usage in usages:
+            if usage.survivors:
+                signal_group(usage.pgid, signal.SIGKILL)
+        wait_for_groups(usages, grace_period, poll_interval)
+
+    return usages
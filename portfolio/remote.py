@@ -0,0 +1,438 @@
+import asyncio
+import json
+import os
+import signal
+import struct
+
+from copy import copy
+from itertools import count
+from pathlib import Path
+from time import monotonic
+
+from portfolio.engine import complete, engine_logger, Execution, run_engine, stop_executions
+from portfolio.limits import exhausted_by_group, release_cgroup
+from portfolio.output import in_thread
+from portfolio.process import sample_group
+
+
+# Every message is a length-prefixed JSON header, followed by a payload of header['size'] raw bytes.
+#
+#   agent -> coordinator:  hello {slots, engines}, need {digest}, status {id, status}, result {id} + result text
+#   coordinator -> agent:  run {id, engine, digest, suffix, budget}, input {digest} + file content, cancel {id}
+#
+# Inputs are addressed by the digest of their content. An agent asks for an input it does not have yet,
+# and keeps it in its workspace, so a node receives every problem file only once, unless it was evicted
+# since. An input that cannot be sent is answered with input {digest, error} and no content.
+
+PROTOCOL = 1
+HEADER = struct.Struct('>I')
+CHUNK_SIZE = 2**20
+POLL_INTERVAL = 0.1
+INPUT_ATTEMPTS = 3
+FAILURE_RESULTS = ('FAIL', 'EXHAUSTED')
+
+# Engine workers are forked with all descriptors of their parent, and must not keep its connections open
+# once the parent is gone, or the other end never learns that it was disconnected
+sockets = set()
+
+def close_sockets():
+    # The socket objects still own their descriptors and close them once they are collected, so each descriptor
+    # is pointed at /dev/null instead, and no file opened later by the worker can get its number
+    if sockets:
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for sock in sockets:
+            if sock.fileno() >= 0:
+                os.dup2(devnull, sock.fileno(), inheritable=False)
+        os.close(devnull)
+    sockets.clear()
+
+os.register_at_fork(after_in_child=close_sockets)
+
+
+def parse_address(address):
+    if address.startswith('unix:'):
+        return Path(address[5:]), None
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+async def open_connection(address):
+    host, port = parse_address(address)
+    if port is None:
+        return await asyncio.open_unix_connection(host, limit=CHUNK_SIZE)
+    return await asyncio.open_connection(host, port, limit=CHUNK_SIZE)
+
+async def start_server(address, handler):
+    host, port = parse_address(address)
+    if port is None:
+        return await asyncio.start_unix_server(handler, host, limit=CHUNK_SIZE)
+    return await asyncio.start_server(handler, host, port, limit=CHUNK_SIZE)
+
+def frame(message, size=0):
+    header = json.dumps({**message, 'size': size}).encode('utf-8')
+    return HEADER.pack(len(header)) + header
+
+async def receive(reader):
+    length, = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return json.loads(await reader.readexactly(length))
+
+async def receive_payload(reader, message, handle=None):
+    # Large payloads are copied to the handle chunk by chunk, instead of being held in memory
+    remaining, data = message['size'], bytearray()
+    while remaining:
+        chunk = await reader.readexactly(min(remaining, CHUNK_SIZE))
+        remaining -= len(chunk)
+        if handle is None:
+            data += chunk
+        else:
+            handle.write(chunk)
+    return bytes(data)
+
+
+class Channel:
+    # Messages with a payload are written in several steps, so writes are serialized per connection
+    def __init__(self, reader, writer, logger):
+        self.reader = reader
+        self.writer = writer
+        self.logger = logger
+        self.lock = asyncio.Lock()
+        self.sending = set()
+        self.socket = writer.get_extra_info('socket')
+        sockets.add(self.socket)
+
+    async def send(self, message, payload=b''):
+        async with self.lock:
+            self.writer.write(frame(message, len(payload)) + payload)
+            await self.writer.drain()
+
+    async def send_file(self, message, path):
+        # A file that cannot be opened leaves the connection usable, but the other end cannot recover
+        # from a payload that ends early, so the connection is closed if reading fails midway
+        with open(path, 'rb') as file_handle:
+            async with self.lock:
+                try:
+                    self.writer.write(frame(message, os.fstat(file_handle.fileno()).st_size))
+                    for chunk in iter(lambda: file_handle.read(CHUNK_SIZE), b''):
+                        self.writer.write(chunk)
+                        await self.writer.drain()
+                except OSError:
+                    self.writer.close()
+                    raise
+
+    def post(self, message, payload=b''):
+        # Sending in the background keeps the callers synchronous, and a lost connection is reported once by the reader
+        async def send():
+            try:
+                await self.send(message, payload)
+            except (ConnectionError, OSError) as e:
+                self.logger.debug(f'Could not send "{message["type"]}" message: {e}')
+        task = asyncio.ensure_future(send())
+        self.sending.add(task)
+        task.add_done_callback(self.sending.discard)
+
+    async def close(self):
+        if self.sending:
+            await asyncio.wait(list(self.sending))
+        sockets.discard(self.socket)
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+class Node:
+    # The coordinator's end of the connection to an agent
+    def __init__(self, address, logger):
+        self.address = address
+        self.logger = logger
+        self.channel = None
+        self.listener = None
+        self.slots = 0
+        self.engines = ()
+        self.jobs = dict()
+        self.inputs = dict()
+        self.ids = count()
+
+    async def connect(self):
+        reader, writer = await open_connection(self.address)
+        self.channel = Channel(reader, writer, self.logger)
+        hello = await receive(reader)
+        if hello.get('type') != 'hello' or hello.get('protocol') != PROTOCOL:
+            await self.channel.close()
+            raise ConnectionError(f'unexpected greeting: {hello}')
+        self.slots, self.engines = hello['slots'], tuple(hello['engines'])
+        self.listener = asyncio.ensure_future(self.listen())
+
+    def serves(self, engine):
+        return self.listener is not None and not self.listener.done() and engine in self.engines
+
+    async def listen(self):
+        try:
+            while True:
+                message = await receive(self.channel.reader)
+                payload = await receive_payload(self.channel.reader, message)
+                if message['type'] == 'need':
+                    asyncio.ensure_future(self.send_input(message['digest']))
+                elif message['type'] == 'status':
+                    self.logger.debug(f'Job {message["id"]} on node "{self.address}" is {message["status"]}.')
+                elif message['type'] == 'result' and message['id'] in self.jobs:
+                    self.jobs.pop(message['id']).set_result(payload.decode('utf-8'))
+        except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+            if self.jobs:
+                self.logger.error(f'Lost the connection to node "{self.address}": {e!r}')
+        finally:
+            for future in self.jobs.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f'lost node "{self.address}"'))
+            self.jobs.clear()
+
+    async def send_input(self, digest):
+        try:
+            await self.channel.send_file({'type': 'input', 'digest': digest}, self.inputs[digest])
+        except (KeyError, OSError) as e:
+            self.logger.error(f'Could not send input {digest[:12]} to node "{self.address}": {e!r}')
+            # The agent fails the jobs that wait for the input, while a lost connection fails all of them here
+            if not self.channel.writer.is_closing():
+                self.channel.post({'type': 'input', 'digest': digest, 'error': repr(e)})
+
+    def submit(self, engine, input_file, digest, budget):
+        job = next(self.ids)
+        self.inputs[digest] = input_file
+        self.jobs[job] = asyncio.get_running_loop().create_future()
+        self.channel.post({'type': 'run', 'id': job, 'engine': engine, 'digest': digest,
+                           'suffix': Path(input_file).suffix, 'budget': budget})
+        return job
+
+    async def result(self, job):
+        return await self.jobs[job]
+
+    def cancel(self, job):
+        if job in self.jobs:
+            self.channel.post({'type': 'cancel', 'id': job})
+
+    async def close(self):
+        if self.listener is not None:
+            self.listener.cancel()
+            await asyncio.wait([self.listener])
+        if self.channel is not None:
+            await self.channel.close()
+
+async def run_remote(task, args, execution):
+    _, engine = task
+    logger = engine_logger(engine, args)
+
+    node = execution.node
+    try:
+        digest = await in_thread(args.workspace.digest, args.input_file)
+        # Stopping skips executions without a job, so one that was cancelled meanwhile is not submitted,
+        # and one that is cancelled from here on is reached through its job
+        if execution.stopped:
+            return 'FAIL'
+        execution.job = node.submit(engine, args.input_file, digest, args.budgets.get(engine, dict()))
+        if execution.stopped:
+            node.cancel(execution.job)
+        logger.debug(f'Running "{engine}" engine on node "{node.address}" as job {execution.job}.')
+        result = await node.result(execution.job)
+    except (ConnectionError, OSError) as e:
+        logger.error(f'Engine "{engine}" failed on node "{node.address}": {e}')
+        return 'FAIL'
+
+    # The agent runs the engine on the preprocessed input, so the solution only needs its post-steps
+    if execution.stopped or not result or result in FAILURE_RESULTS:
+        return result or 'FAIL'
+    return await in_thread(complete, result, args, logger)
+
+
+class AgentSession:
+    # The agent's end of the connection to a coordinator. Jobs are run like local engines, and all of them are
+    # stopped when the coordinator disconnects.
+    def __init__(self, args, logger, reader, writer):
+        self.args = args
+        self.logger = logger
+        self.channel = Channel(reader, writer, logger)
+        self.jobs = dict()
+        self.executions = dict()
+        self.waiting = dict()
+
+    async def serve(self):
+        try:
+            await self.channel.send({'type': 'hello', 'protocol': PROTOCOL,
+                                     'slots': self.args.jobs, 'engines': self.args.engines})
+            while True:
+                message = await receive(self.channel.reader)
+                if message['type'] == 'input':
+                    await self.store(message)
+                    continue
+                await receive_payload(self.channel.reader, message)
+                if message['type'] == 'run':
+                    self.submit(message)
+                elif message['type'] == 'cancel':
+                    self.cancel(message['id'])
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            self.logger.debug(f'Coordinator disconnected.')
+        finally:
+            if self.jobs:
+                self.logger.info(f'Stopping {len(self.jobs)} job(s) of the disconnected coordinator ...')
+                jobs = list(self.jobs.values())
+                for job in list(self.executions):
+                    self.cancel(job)
+                await asyncio.wait(jobs)
+            await self.channel.close()
+
+    def cancel(self, job):
+        execution = self.executions.get(job)
+        if execution is None or execution.stopped:
+            return
+        self.logger.debug(f'Cancelling job {job} ...')
+        execution.stopped = True
+        if execution.future is None:
+            # The job is still waiting for its input, and reports its failure once cancelled
+            self.jobs[job].cancel()
+        else:
+            asyncio.ensure_future(stop_executions([execution], self.args.grace_period))
+
+    def submit(self, message):
+        if message['engine'] not in self.args.engines:
+            self.logger.warning(f'Rejecting job {message["id"]} for unknown engine "{message["engine"]}".')
+            self.channel.post({'type': 'result', 'id': message['id']}, b'FAIL')
+            return
+
+        self.request(message['digest'])
+        execution = Execution()
+        self.executions[message['id']] = execution
+        self.jobs[message['id']] = asyncio.ensure_future(self.run(message, execution))
+
+    def request(self, digest):
+        # An input is asked for again once it was evicted from the store, or once its transfer failed
+        waiting = self.waiting.get(digest)
+        if waiting is None or waiting.done() and not self.args.workspace.contains((digest, 'input')):
+            waiting = self.waiting[digest] = asyncio.get_running_loop().create_future()
+            if self.args.workspace.contains((digest, 'input')):
+                waiting.set_result(None)
+            else:
+                self.channel.post({'type': 'need', 'digest': digest})
+        return waiting
+
+    def fail(self, digest, error):
+        waiting = self.waiting.pop(digest, None)
+        if waiting is not None and not waiting.done():
+            waiting.set_exception(OSError(f'input {digest[:12]} was not received: {error}'))
+
+    async def store(self, message):
+        if 'error' in message:
+            self.fail(message['digest'], message['error'])
+            return
+
+        # The input is written once, then only linked into the directories of the jobs that use it
+        tfile_path = self.args.workspace.path.joinpath(f'{message["digest"]}.input')
+        try:
+            tfile_handle = open(tfile_path, 'wb')
+        except OSError as e:
+            with open(os.devnull, 'wb') as null_handle:
+                await receive_payload(self.channel.reader, message, null_handle)
+            self.logger.error(f'Could not store input {message["digest"][:12]}: {e!r}')
+            self.fail(message['digest'], repr(e))
+            return
+        with tfile_handle:
+            await receive_payload(self.channel.reader, message, tfile_handle)
+        self.args.workspace.remember((message['digest'], 'input'), tfile_path, None)
+        os.remove(tfile_path)
+        self.logger.debug(f'Received input {message["digest"][:12]} ({message["size"]} bytes).')
+
+        waiting = self.waiting.get(message['digest'])
+        if waiting is not None and not waiting.done():
+            waiting.set_result(None)
+
+    async def run(self, message, execution):
+        task = (message['id'], message['engine'])
+        directory = self.args.workspace.directory()
+        try:
+            self.channel.post({'type': 'status', 'id': message['id'], 'status': 'waiting for input'})
+            # Inputs received for other jobs may evict this one before it is linked, which asks for it again
+            linked = None
+            for _ in range(INPUT_ATTEMPTS):
+                await self.request(message['digest'])
+                linked = self.args.workspace.lookup((message['digest'], 'input'), directory)
+                if linked is not None:
+                    break
+            if linked is None:
+                self.logger.error(f'Job {message["id"]} could not keep its input {message["digest"][:12]}.')
+                result = 'FAIL'
+            else:
+                # The link is renamed to the suffix of the original input, for engines that check it
+                input_file = directory.joinpath(f'input{message["suffix"]}')
+                os.rename(linked[0], input_file)
+                result = await self.supervise(task, input_file, message['budget'], directory, execution)
+        except asyncio.CancelledError:
+            result = 'FAIL'
+        except Exception as e:
+            self.logger.error(f'Job {message["id"]} failed: {e!r}')
+            result = 'FAIL'
+        finally:
+            self.args.workspace.release(directory)
+            self.executions.pop(message['id'], None)
+            self.jobs.pop(message['id'], None)
+
+        self.logger.debug(f'Job {message["id"]} finished: {result[:64]}')
+        self.channel.post({'type': 'result', 'id': message['id']}, result.encode('utf-8'))
+        return result
+
+    async def supervise(self, task, input_file, budget, directory, execution):
+        _, engine = task
+        args = copy(self.args)
+        args.input_file = input_file
+        args.temp_path = directory
+        args.budgets = {engine: budget}
+        args.post_steps = ()
+        args.cpus = None
+
+        self.channel.post({'type': 'status', 'id': task[0], 'status': 'running'})
+        execution.future = asyncio.ensure_future(run_engine(task, args, execution))
+        try:
+            while True:
+                done, _ = await asyncio.wait([execution.future], timeout=POLL_INTERVAL)
+                if done:
+                    return execution.future.result() or 'FAIL'
+                if budget and execution.pid is not None and not execution.stopped:
+                    exhausted = exhausted_by_group(budget, monotonic() - execution.started, sample_group(execution.pid))
+                    if exhausted:
+                        self.logger.warning(f'Job {task[0]} ("{engine}") exhausted its {exhausted} budget.')
+                        execution.stopped = True
+                        await stop_executions([execution], self.args.grace_period)
+                        return 'EXHAUSTED'
+        finally:
+            if execution.pid is not None:
+                release_cgroup(execution.pid)
+
+async def serve(args, logger):
+    # Every coordinator gets its own session, until the agent is stopped by a signal
+    sessions = set()
+    async def handle(reader, writer):
+        logger.info(f'Coordinator connected: {writer.get_extra_info("peername") or "local socket"}.')
+        sessions.add((asyncio.current_task(), writer))
+        try:
+            await AgentSession(args, logger, reader, writer).serve()
+        finally:
+            sessions.discard((asyncio.current_task(), writer))
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+
+    server = await start_server(args.address, handle)
+    sockets.update(server.sockets)
+    try:
+        await stopping.wait()
+        logger.info(f'Stopping the agent ...')
+    finally:
+        server.close()
+        # A closed connection makes its session stop the jobs it is running
+        for _, writer in list(sessions):
+            writer.close()
+        if sessions:
+            await asyncio.wait([task for task, _ in sessions])
+        await server.wait_closed()
+        host, port = parse_address(args.address)
+        if port is None:
+            host.unlink(missing_ok=True)
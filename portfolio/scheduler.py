@@ -0,0 +1,459 @@
+import asyncio
+import os
+
+from collections import deque
+from itertools import chain, zip_longest
+from concurrent.futures import Future, ThreadPoolExecutor
+from copy import copy
+from pathlib import Path
+from time import monotonic, time
+
+from portfolio import telemetry
+from portfolio.components import decompose
+from portfolio.engine import Execution, run_engine, stop_executions
+from portfolio.hints import conjoin, HintStore
+from portfolio.limits import exhausted_by_group, release_cgroup
+from portfolio.preprocess import engine_stages, Pipeline
+from portfolio.process import sample_group
+
+
+POLL_INTERVAL = 0.1
+HINT_BATCH = 64
+FAILURE_STATUSES = ('FAIL', 'EXHAUSTED')
+OUTCOMES = {'FAIL': 'fail', 'EXHAUSTED': 'exhausted'}
+
+
+class Scheduler:
+    def __init__(self, args, logger, slots, history=None, invariants=None):
+        self.args = args
+        self.logger = logger
+        self.slots = slots
+        self.history = history
+        self.invariants = invariants
+
+        self.executor = ThreadPoolExecutor(max_workers=slots)
+
+        # Each local engine is pinned to a CPU of its own while there are enough of them, so that engines
+        # neither migrate between cores nor share one, while the portfolio itself is free to run anywhere
+        cpus = sorted(os.sched_getaffinity(0))
+        self.cpus = cpus if len(cpus) >= slots else []
+        self.pending = []
+        self.pipelines = dict()
+        self.preparing = dict()
+        self.lemmas = dict()
+        self.hints = dict()
+        self.directories = dict()
+        self.running = dict()
+        self.background = []
+        self.results = dict()
+        self.started = dict()
+        self.failed = []
+        self.finished = deque()
+        self.classes = dict()
+        self.outcomes = dict()
+        self.components = dict()
+        self.parents = dict()
+        self.nodes = []
+        if getattr(args, 'nodes', None):
+            # The socket protocol is only loaded for runs that use other nodes
+            from portfolio.remote import Node
+            self.nodes = [Node(address, logger) for address in args.nodes]
+
+    def rank(self, instance, engines, args):
+        delays = dict.fromkeys(engines, 0)
+        if not self.history:
+            return engines, delays
+
+        try:
+            self.classes[instance] = self.history.classify(args.input_file)
+            engines, delays = self.history.rank(self.classes[instance], engines)
+        except Exception as e:
+            self.logger.warning(f'Could not rank engines for "{instance}": {e}')
+            return engines, delays
+
+        # Delays are relative to the first engine, so that some engine always starts immediately
+        first = min(delays.values())
+        return engines, {engine: delay - first for engine, delay in delays.items()}
+
+    def submit(self, instance, engines, args):
+        components = None
+        if args.decompose:
+            components = self.decompose(instance, args)
+        if not components:
+            self.enqueue(instance, engines, args)
+            return
+
+        paths, definitions, directory = components
+        self.components[instance] = {'pending': set(), 'results': dict(), 'definitions': definitions,
+                                     'directory': directory, 'started': monotonic()}
+
+        # The engines of all components are interleaved by rank, so every component gets its best engines first
+        first, groups = len(self.pending), []
+        for index, path in enumerate(paths):
+            component = (instance, index)
+            component_args = copy(args)
+            component_args.input_file = Path(path)
+            self.parents[component] = instance
+            self.components[instance]['pending'].add(component)
+            start = len(self.pending)
+            self.enqueue(component, engines, component_args)
+            groups.append(self.pending[start:])
+        self.pending[first:] = [item for item in chain(*zip_longest(*groups)) if item is not None]
+
+    def decompose(self, instance, args):
+        if args.format != 'smt':
+            self.logger.debug(f'Not decomposing "{instance}", as only SMT inputs can be decomposed.')
+            return None
+
+        directory = self.args.workspace.directory()
+        try:
+            with telemetry.span('decompose', 'scheduler'):
+                components = decompose(args.input_file, directory)
+        except Exception as e:
+            self.logger.warning(f'Could not decompose "{instance}": {e}')
+            components = None
+        if not components:
+            self.args.workspace.release(directory)
+            return None
+
+        paths, definitions = components
+        self.logger.info(f'Split "{instance}" into {len(paths)} independent component(s)'
+                         f'{f", with {len(definitions)} predicate(s) that need no solving" if definitions else ""}.')
+        return paths, definitions, directory
+
+    def enqueue(self, instance, engines, args):
+        engines, delays = self.rank(instance, engines, args)
+
+        # All files of an instance are created in its own directory, which is removed once it is finished
+        args = copy(args)
+        args.temp_path = self.directories[instance] = self.args.workspace.directory()
+
+        # The past invariants are checked while other instances are solved, and the engines start from the
+        # input that their inductive conjuncts strengthen
+        root = None
+        if self.invariants:
+            root = Future()
+            self.preparing[instance] = (self.executor.submit(self.prepare, args), root)
+
+        pipeline = Pipeline(args, self.logger, self.executor, root)
+        self.pipelines[instance] = pipeline
+        self.results[instance] = dict.fromkeys(engines)
+        self.outcomes[instance] = dict()
+        for engine in engines:
+            try:
+                stages = engine_stages(engine, args)
+            except Exception as e:
+                # The worker reports the failure to load the runner in detail
+                self.logger.debug(f'Could not determine preprocessing stages for "{engine}" engine: {e}')
+                stages = ()
+            self.pending.append(((instance, engine), args, stages, pipeline.node(stages), delays[engine]))
+
+    def prepare(self, args):
+        # The pipeline root waits for this, so any failure must still let the engines start from the input
+        try:
+            with telemetry.span('invariants', 'scheduler'):
+                return self.invariants.prepare(args.input_file, args)
+        except Exception as e:
+            self.logger.warning(f'Could not check the past invariants for "{args.input_file}": {e}')
+            return None, dict(), args.input_file
+
+    def prepared(self):
+        for instance, (future, root) in list(self.preparing.items()):
+            if not future.done():
+                continue
+            del self.preparing[instance]
+            solution, lemmas, input_file = future.result()
+            if solution is None:
+                self.lemmas[instance] = lemmas
+                root.set_result(input_file)
+                continue
+
+            # No engine ran, so there is nothing to learn from
+            self.classes.pop(instance, None)
+            self.cancel(instance)
+            self.conclude(instance, 'invariants', solution)
+
+    def share(self):
+        # The published lemmas of an input are checked in the background, in batches, one batch at a time
+        for stores in self.hints.values():
+            for store in stores.values():
+                if store.candidates and (store.checking is None or store.checking.done()):
+                    store.checking = self.executor.submit(self.check_hints, store)
+
+    def check_hints(self, store):
+        from portfolio.invariants import shared_hints
+
+        candidates = store.take(HINT_BATCH)
+        try:
+            with telemetry.span('hints', 'scheduler'):
+                hints = shared_hints(store.input_file, store.hints, candidates, self.args)
+        except Exception as e:
+            self.logger.warning(f'Could not check the lemmas published for "{store.input_file}": {e}')
+            return
+
+        # The hints are replaced as a whole, so an engine keeps the ones it started with
+        added = sum(map(len, hints.values())) - sum(map(len, store.hints.values()))
+        store.hints = hints
+        self.logger.debug(f'{added} of {len(candidates)} published lemma(s) for "{store.input_file}" are inductive,'
+                          f' {sum(map(len, hints.values()))} hint(s) are shared.')
+
+    def load(self, node):
+        return sum(1 for execution in self.running.values() if execution.node is node)
+
+    def place(self, engine, reserved):
+        # Local slots are filled first, as they need no transfer, then the least loaded node serving the engine
+        if self.load(None) + reserved < self.slots:
+            return None, True
+        nodes = [node for node in self.nodes if node.serves(engine) and self.load(node) < node.slots]
+        if not nodes:
+            return None, False
+        return min(nodes, key=lambda node: self.load(node) / node.slots), True
+
+    def launch(self):
+        # Engines are launched in rank order, and a slot is kept for each engine that is still preprocessing.
+        # Once its instance has run for the defer limit, an engine is started even without a free slot,
+        # so that an engine which never terminates cannot starve the lower-ranked ones.
+        now, reserved = monotonic(), 0
+        for item in list(self.pending):
+            task, args, stages, preprocessed, delay = item
+            elapsed = now - self.started.get(task[0], now)
+            if elapsed < delay:
+                continue
+            if not preprocessed.done():
+                reserved += 1
+                continue
+            node, placed = self.place(task[1], reserved)
+            if not placed and (task[0] not in self.started or elapsed < delay + self.args.defer_limit):
+                continue
+            self.pending.remove(item)
+            self.started.setdefault(task[0], monotonic())
+
+            if preprocessed.exception() is not None:
+                self.logger.error(f'Preprocessing for "{task[1]}" engine failed: {preprocessed.exception()}')
+                self.failed.append((task, 'FAIL'))
+                continue
+
+            args = copy(args)
+            args.input_file = Path(preprocessed.result())
+            args.post_steps = self.pipelines[task[0]].post_steps(stages)
+            # Engines started past the defer limit find no free CPU, and run unpinned
+            args.cpus = {self.cpus.pop(0)} if node is None and self.cpus else None
+            # Lemmas are shared between the local engines that solve the same preprocessed input
+            if args.share_hints and node is None:
+                args.hints = self.hints.setdefault(task[0], dict()).setdefault(args.input_file, HintStore(args.input_file))
+            execution = Execution()
+            execution.node = node
+            execution.cpus = args.cpus
+            if node is None:
+                execution.future = asyncio.ensure_future(run_engine(task, args, execution))
+            else:
+                from portfolio.remote import run_remote
+                execution.future = asyncio.ensure_future(run_remote(task, args, execution))
+            self.running[task] = execution
+
+    async def collect(self):
+        futures = {execution.future: task for task, execution in self.running.items()}
+
+        events, self.failed = self.failed, []
+
+        # Engines report through their own futures, so the loop wakes up as soon as any of them is done
+        if futures:
+            done, _ = await asyncio.wait(futures, timeout=POLL_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+        else:
+            done = await asyncio.sleep(POLL_INTERVAL, ())
+        for future in done:
+            if future.exception() is not None:
+                self.logger.error(f'Engine "{futures[future][1]}" crashed: {future.exception()}')
+                events.append((futures[future], 'FAIL'))
+            else:
+                events.append((futures[future], future.result()))
+
+        reported = set(task for task, _ in events)
+        for task, execution in list(self.running.items()):
+            budget = self.args.budgets.get(task[1])
+            if task in reported or not budget or execution.pid is None:
+                continue
+            exhausted = exhausted_by_group(budget, monotonic() - execution.started, sample_group(execution.pid))
+            if exhausted:
+                self.logger.warning(f'Engine "{task[1]}" exhausted its {exhausted} budget.')
+                self.stop({task: self.running.pop(task)})
+                events.append((task, 'EXHAUSTED'))
+
+        return events
+
+    def defer(self, coroutine):
+        self.background = [future for future in self.background if not future.done()]
+        self.background.append(asyncio.ensure_future(coroutine))
+
+    def stop(self, executions):
+        # Stopping takes up to twice the grace period, which must not hold back the results of other engines
+        for execution in executions.values():
+            execution.stopped = True
+        self.defer(self.terminate(executions))
+
+    async def terminate(self, executions):
+        groups = {execution.pid: task for task, execution in executions.items() if execution.pid is not None}
+        cpu = dict()
+        for usage in await stop_executions(list(executions.values()), self.args.grace_period):
+            if not usage.cpu_by_pid:
+                continue
+            engine = groups[usage.pgid][1]
+            cpu[groups[usage.pgid]] = round(usage.cpu, 6)
+            self.logger.info(f'Engine "{engine}" used {usage.cpu:.2f}s of CPU time'
+                             f' ({usage.cpu - usage.cpu_at_stop:.2f}s after cancellation).')
+            if usage.survivors:
+                self.logger.error(f'Engine "{engine}" has surviving processes: {usage.survivors}!')
+
+        for task, execution in executions.items():
+            self.release(task, execution, 'stopped', cpu.get(task))
+
+    def release(self, task, execution, outcome=None, cpu=None):
+        if execution.pid is not None:
+            release_cgroup(execution.pid)
+        if execution.cpus:
+            self.cpus.extend(execution.cpus)
+
+        # Each engine is drawn on its own track, from its launch until it has been released
+        end = time()
+        telemetry.record(f'engine:{task[1]}', 'scheduler', end - (monotonic() - execution.started), end,
+                         tid=execution.pid, instance=str(task[0]), outcome=outcome, cpu=cpu)
+
+    def cancel(self, instance):
+        self.pending = [item for item in self.pending if item[0][0] != instance]
+        cancelled = {task: self.running.pop(task) for task in list(self.running) if task[0] == instance}
+        for task, execution in cancelled.items():
+            self.outcomes[instance][task[1]] = ('loss', monotonic() - execution.started)
+        if cancelled:
+            self.stop(cancelled)
+
+    async def advance(self):
+        # Runs the portfolio until an instance is finished, or until nothing is left to run
+        while not self.finished and (self.pending or self.running or self.failed):
+            self.prepared()
+            self.share()
+            self.launch()
+            for task, result in await self.collect():
+                instance, engine = task
+                elapsed = 0
+                if task in self.running:
+                    execution = self.running.pop(task)
+                    elapsed = monotonic() - execution.started
+                    self.release(task, execution, outcome=OUTCOMES.get(result, 'solved'))
+                if instance not in self.results:
+                    continue
+
+                self.results[instance][engine] = result
+                self.outcomes[instance][engine] = (OUTCOMES.get(result, 'win'), elapsed)
+                if result == 'EXHAUSTED':
+                    self.logger.warning(f'Engine "{engine}" gave up after exhausting its budget.')
+                elif result == 'FAIL':
+                    self.logger.warning(f'Engine "{engine}" failed with an exception!')
+                else:
+                    self.logger.info(f'Received a solution from engine "{engine}".')
+                    self.logger.debug(f'Terminating remaining engines ...')
+                    self.cancel(instance)
+                    self.conclude(instance, engine, result)
+                    continue
+
+                results = self.results[instance].values()
+                if all(results):
+                    self.conclude(instance, None, 'EXHAUSTED' if 'EXHAUSTED' in results else 'FAIL')
+        return self.finished.popleft() if self.finished else None
+
+    async def connect(self):
+        for node in self.nodes:
+            try:
+                await node.connect()
+                self.logger.info(f'Connected to node "{node.address}" with {node.slots} slot(s)'
+                                 f' for {len(node.engines)} engine(s).')
+            except (asyncio.IncompleteReadError, OSError, ValueError) as e:
+                self.logger.warning(f'Could not connect to node "{node.address}": {e}')
+
+    async def shutdown(self):
+        for instance in set(task[0] for task in self.running):
+            self.cancel(instance)
+        if self.background:
+            await asyncio.wait(self.background)
+        for node in self.nodes:
+            await node.close()
+
+    def run(self):
+        # Preprocessing, engine launches, output streaming, cancellation and postprocessing all share one
+        # event loop, which only runs while the caller waits for the next result
+        loop = asyncio.new_event_loop()
+        advance = None
+        try:
+            loop.run_until_complete(self.connect())
+            while finished := loop.run_until_complete(advance := loop.create_task(self.advance())):
+                yield finished
+        finally:
+            # A signal may interrupt the loop in the middle of a step, which must not resume during the shutdown
+            if advance is not None:
+                advance.cancel()
+            loop.run_until_complete(self.shutdown())
+            loop.close()
+            self.executor.shutdown(cancel_futures=True)
+
+    async def discard(self, directory, stopping):
+        # Cancelled engines may still be reading their inputs, so the directory outlives their termination
+        if stopping:
+            await asyncio.wait(stopping)
+        usage = self.args.workspace.release(directory)
+        self.logger.debug(f'Released "{directory}" with the workspace at {usage / 2**10:.0f} KB.')
+
+    def conclude(self, instance, engine, result):
+        # The engines solved the strengthened clauses, which the lemmas turn into a solution of the original ones
+        if self.lemmas.get(instance) and result not in FAILURE_STATUSES:
+            result = conjoin(result, self.lemmas[instance])
+        finished = self.finish(instance, engine, result)
+        if instance not in self.parents:
+            self.finished.append(finished)
+            return
+
+        parent = self.parents.pop(instance)
+        components = self.components[parent]
+        components['pending'].discard(instance)
+        components['results'][instance] = (engine, result)
+
+        if result in FAILURE_STATUSES:
+            # The system has no model if one of its components has none, so the others are not needed anymore
+            self.logger.info(f'Component {instance[1]} of "{parent}" was not solved, stopping the other components.')
+            for component in components['pending']:
+                # Components that are cut short are not learned from
+                self.classes.pop(component, None)
+                self.parents.pop(component)
+                self.cancel(component)
+                self.finish(component, None, result)
+        elif not components['pending']:
+            self.logger.info(f'Merging the models of {len(components["results"])} component(s) of "{parent}".')
+        else:
+            return
+
+        del self.components[parent]
+        self.defer(self.discard(components['directory'], list(self.background)))
+        elapsed = monotonic() - components['started']
+        if result in FAILURE_STATUSES:
+            self.finished.append((parent, None, result, elapsed))
+            return
+
+        results = [components['results'][component] for component in sorted(components['results'])]
+        engines = '+'.join(sorted(set(engine for engine, _ in results)))
+        model = '\n'.join([result for _, result in results] + components['definitions'])
+        self.finished.append((parent, engines, model, elapsed))
+
+    def finish(self, instance, engine, result):
+        del self.results[instance]
+        del self.pipelines[instance]
+        self.preparing.pop(instance, None)
+        self.lemmas.pop(instance, None)
+        self.hints.pop(instance, None)
+        self.defer(self.discard(self.directories.pop(instance), list(self.background)))
+        outcomes = self.outcomes.pop(instance)
+        if instance in self.classes:
+            try:
+                self.history.record(self.classes.pop(instance), outcomes)
+            except Exception as e:
+                self.logger.warning(f'Could not record the outcome for "{instance}": {e}')
+        # Instances solved without starting an engine took no time of the portfolio
+        started = self.started.pop(instance, None)
+        return instance, engine, result, 0 if started is None else monotonic() - started
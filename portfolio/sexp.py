@@ -0,0 +1,169 @@
+import re
+
+from io import UnsupportedOperation
+from mmap import ACCESS_READ, mmap
+from os import PathLike
+from sys import intern
+
+
+TOKEN = re.compile(r'''"(?:[^"]|"")*"|\|[^|]*\||[()]|[^\s()";|]+|;[^\n]*|\S''')
+BOUNDARY = re.compile(rb'''"(?:[^"]|"")*"|\|[^|]*\||;[^\n]*|[()]''')
+HEAD = re.compile(rb'''\(\s*([^\s()";|]+)''')
+STREAM_BOUNDARY = re.compile(rb'''"(?:[^"]|"")*"?|\|[^|]*\|?|;[^\n]*\n?|[()]''')
+
+
+class ParseError(ValueError):
+    pass
+
+
+def location(text, index):
+    for i, token in enumerate(TOKEN.finditer(text)):
+        if i == index:
+            offset = token.start()
+            line = text.count('\n', 0, offset) + 1
+            column = offset - text.rfind('\n', 0, offset)
+            return f'line {line}, column {column}'
+    return 'end of input'
+
+def unquote(symbol):
+    return symbol[1:-1] if len(symbol) > 1 and symbol[0] == symbol[-1] == '|' else symbol
+
+def parse(text):
+    # Every list is attached to its parent as soon as it is opened,
+    # so closing one only needs to pop the stack of open lists.
+    # Atoms are interned, so repeated symbols share a single string.
+    stack = [[]]
+    top = stack[0]
+    for index, token in enumerate(TOKEN.findall(text)):
+        head = token[0]
+        if head == '(':
+            expr = []
+            top.append(expr)
+            stack.append(expr)
+            top = expr
+        elif head == ')':
+            if len(stack) < 2:
+                raise ParseError(f'Unexpected ")" at {location(text, index)}')
+            stack.pop()
+            top = stack[-1]
+        elif head == ';':
+            continue
+        elif len(token) == 1 and head in '"|':
+            raise ParseError(f'Unterminated {token} at {location(text, index)}')
+        else:
+            top.append(intern(token))
+
+    if len(stack) > 1:
+        raise ParseError(f'Missing {len(stack) - 1} closing parenthes{"is" if len(stack) == 2 else "es"}')
+    return stack[0]
+
+def parse_file(path):
+    with open(path, 'r') as file_handle:
+        return parse(file_handle.read())
+
+def scan_commands(data, heads=None):
+    # Only parentheses, strings, quoted symbols and comments are matched here,
+    # so locating the next top-level command skips over all other atoms.
+    # Each command is parsed only once its closing parenthesis has been found.
+    depth, start = 0, 0
+    for token in BOUNDARY.finditer(data):
+        head = token.group()[0]
+        if head == 0x28:
+            if depth == 0:
+                start = token.start()
+            depth += 1
+        elif head == 0x29:
+            depth -= 1
+            if depth == 0:
+                if heads is not None:
+                    match = HEAD.match(data, start)
+                    if match is None or match.group(1).decode() not in heads:
+                        continue
+                yield parse(data[start:token.end()].decode('utf-8'))[0]
+            elif depth < 0:
+                raise ParseError(f'Unexpected ")" at byte {token.start()}')
+
+    if depth > 0:
+        raise ParseError(f'Missing {depth} closing parenthes{"is" if depth == 1 else "es"}')
+
+def iter_commands(source, heads=None):
+    if isinstance(source, (str, PathLike)):
+        with open(source, 'rb') as source_handle:
+            yield from iter_commands(source_handle, heads)
+        return
+
+    try:
+        data = mmap(source.fileno(), 0, access=ACCESS_READ)
+    except (AttributeError, OSError, UnsupportedOperation, ValueError):
+        # Pipes and empty files cannot be mapped, so they are read in full instead
+        data = source.read()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        yield from scan_commands(data, heads)
+        return
+
+    with data:
+        yield from scan_commands(data, heads)
+
+def scan_lists(chunks, depth=0):
+    # The lists at the given nesting depth are yielded as raw bytes as soon as they are closed, and
+    # only the data of the current list is kept. A string, quoted symbol or comment that reaches the
+    # end of the data may continue in the next chunk, so it is scanned again once more data has arrived.
+    data, scanned, level, start = bytearray(), 0, 0, None
+    for chunk in chunks:
+        data += chunk
+        for token in STREAM_BOUNDARY.finditer(data, scanned):
+            head = token.group()[0]
+            if head == 0x28:
+                if level == depth:
+                    start = token.start()
+                level += 1
+            elif head == 0x29:
+                level -= 1
+                if level == depth and start is not None:
+                    yield bytes(data[start:token.end()])
+                    start = None
+                elif level < 0:
+                    raise ParseError('Unexpected ")" in stream')
+            elif token.end() == len(data):
+                scanned = token.start()
+                break
+            scanned = token.end()
+        else:
+            scanned = len(data)
+
+        keep = scanned if start is None else start
+        del data[:keep]
+        scanned -= keep
+        if start is not None:
+            start = 0
+
+    if level > 0:
+        raise ParseError(f'Missing {level} closing parenthes{"is" if level == 1 else "es"}')
+
+def serialize(expr):
+    if type(expr) is not list:
+        return expr
+
+    # An explicit stack avoids hitting the recursion limit on deeply nested terms
+    pieces = []
+    stack = [(expr, 0)]
+    while stack:
+        expr, index = stack.pop()
+        if index == 0:
+            pieces.append('(')
+        elif index < len(expr):
+            pieces.append(' ')
+
+        if index == len(expr):
+            pieces.append(')')
+            continue
+
+        stack.append((expr, index + 1))
+        child = expr[index]
+        if type(child) is list:
+            stack.append((child, 0))
+        else:
+            pieces.append(child)
+
+    return ''.join(pieces)
@@ -0,0 +1,330 @@
+from collections import Counter
+from itertools import count
+
+from portfolio.components import clause_predicates, is_predicate
+from portfolio.sexp import serialize, unquote
+
+
+# The simplified system is satisfiable exactly when the original one is, and every eliminated predicate
+# gets an interpretation in terms of the remaining ones, which the post-step adds to the model:
+#
+#   - a predicate that no rule defines is empty, and one that no query depends on can be anything,
+#     so their clauses are dropped and they are interpreted as false and true, like the predicates
+#     that occur in no clause at all
+#   - a predicate with a single, non-recursive rule is replaced by the body of that rule
+#   - an argument that is the same constant in every head, or a variable that occurs nowhere else in
+#     every body, is dropped, and the remaining predicate is extended again in the model
+
+
+BINDERS = {'let', 'exists', 'forall', 'lambda', 'match'}
+
+
+class Clause:
+    def __init__(self, variables, body, head):
+        self.variables = variables
+        self.body = body
+        self.head = head
+
+    def term(self):
+        body = [literal for literal in self.body if literal != 'true']
+        matrix = self.head if not body else ['=>', body[0] if len(body) == 1 else ['and'] + body, self.head]
+        used = symbols(matrix)
+        variables = [variable for variable in self.variables if variable[0] in used]
+        return ['forall', variables, matrix] if variables else matrix
+
+
+def symbols(term):
+    found, stack = Counter(), [term]
+    while stack:
+        term = stack.pop()
+        if type(term) is list:
+            stack.extend(term)
+        else:
+            found[term] += 1
+    return found
+
+def substitute(term, mapping):
+    if type(term) is not list:
+        return mapping.get(term, term)
+    result = []
+    stack = [(term, result)]
+    while stack:
+        source, target = stack.pop()
+        for item in source:
+            if type(item) is list:
+                target.append([])
+                stack.append((item, target[-1]))
+            else:
+                target.append(mapping.get(item, item))
+    return result
+
+def conjuncts(term):
+    result, stack = [], [term]
+    while stack:
+        term = stack.pop()
+        if type(term) is list and term and term[0] == 'and':
+            stack.extend(reversed(term[1:]))
+        else:
+            result.append(term)
+    return result
+
+def application(term, predicates):
+    if type(term) is list and term and type(term[0]) is str and unquote(term[0]) in predicates:
+        return unquote(term[0]), term[1:]
+    if type(term) is str and unquote(term) in predicates:
+        return unquote(term), []
+    return None
+
+def apply(symbol, arguments):
+    return [symbol] + arguments if arguments else symbol
+
+def normalize(term, predicates):
+    # Only clauses of the form (forall (...) (=> body head)) are simplified, with predicates only
+    # occurring as conjuncts of the body or as the head
+    variables = []
+    while type(term) is list and len(term) == 3 and term[0] == 'forall':
+        variables = variables + term[1]
+        term = term[2]
+    body, head = [], term
+    if type(term) is list and len(term) == 3 and term[0] == '=>':
+        body, head = conjuncts(term[1]), term[2]
+
+    if head != 'false' and application(head, predicates) is None:
+        return None
+    for literal in body:
+        if application(literal, predicates) is None and clause_predicates(literal, predicates):
+            return None
+    return Clause(variables, body, head)
+
+def fresh_names():
+    counter = count()
+    def fresh(name):
+        base = unquote(name)
+        renamed = f'{base}!s{next(counter)}'
+        return f'|{renamed}|' if base != name else renamed
+    return fresh
+
+def instantiate(rule, arguments, fresh):
+    # The variables and literals that replace an application of the rule's head to the arguments.
+    # A head parameter that is a variable seen for the first time is bound to its argument, any other one
+    # becomes an equality.
+    parameters = rule.head[1:] if type(rule.head) is list else []
+    renamed = {name: fresh(name) for name, _ in rule.variables}
+    bound, equalities = dict(), []
+    for position, parameter in enumerate(parameters):
+        if type(parameter) is str and parameter in renamed and parameter not in bound:
+            bound[parameter] = arguments[position]
+        else:
+            equalities.append(position)
+
+    mapping = {**renamed, **bound}
+    literals = [['=', arguments[position], substitute(parameters[position], mapping)] for position in equalities]
+    literals.extend(substitute(literal, mapping) for literal in rule.body)
+    variables = [[renamed[name], sort] for name, sort in rule.variables if name not in bound]
+    return variables, literals
+
+def head_of(clause, predicates):
+    return application(clause.head, predicates)[0] if clause.head != 'false' else None
+
+def body_predicates(clause, predicates):
+    return [application(literal, predicates)[0] for literal in clause.body if application(literal, predicates)]
+
+def deduplicate(clauses):
+    seen, unique = set(), []
+    for clause in clauses:
+        key = serialize(clause.term())
+        if key not in seen:
+            seen.add(key)
+            unique.append(clause)
+    return unique
+
+def remove_unused(clauses, predicates, definitions):
+    while True:
+        defined = set(head_of(clause, predicates) for clause in clauses)
+        empty = set(predicate for clause in clauses for predicate in body_predicates(clause, predicates)
+                    if predicate not in defined)
+
+        # Only the predicates that a query depends on need to be solved
+        needed, stack = set(), [clause for clause in clauses if clause.head == 'false']
+        rules = dict()
+        for clause in clauses:
+            rules.setdefault(head_of(clause, predicates), []).append(clause)
+        while stack:
+            for predicate in body_predicates(stack.pop(), predicates):
+                if predicate not in needed:
+                    needed.add(predicate)
+                    stack.extend(rules.get(predicate, ()))
+        unneeded = defined - needed - {None}
+
+        if not empty and not unneeded:
+            return clauses
+        definitions.extend([predicate, 'false'] for predicate in sorted(empty))
+        definitions.extend([predicate, 'true'] for predicate in sorted(unneeded))
+        clauses = [clause for clause in clauses
+                   if head_of(clause, predicates) not in unneeded
+                   and not empty.intersection(body_predicates(clause, predicates))]
+
+def inline(clauses, predicates, definitions, fresh):
+    while True:
+        heads = Counter(head_of(clause, predicates) for clause in clauses)
+        uses = Counter(predicate for clause in clauses for predicate in body_predicates(clause, predicates))
+        for rule in clauses:
+            predicate = head_of(rule, predicates)
+            if predicate is None or heads[predicate] != 1 or predicate in body_predicates(rule, predicates):
+                continue
+            # A rule that depends on other predicates is only copied into a single body, so the system cannot grow
+            if uses[predicate] > 1 and body_predicates(rule, predicates):
+                continue
+            # Inner binders could capture the variables of the clauses the rule is copied into
+            if BINDERS.intersection(symbols([rule.body, rule.head])):
+                continue
+            break
+        else:
+            return clauses
+
+        parameters = [f'x!{i}' for i in range(len(predicates[predicate][2]))]
+        variables, literals = instantiate(rule, parameters, fresh)
+        body = literals[0] if len(literals) == 1 else ['and'] + literals if literals else 'true'
+        definitions.append([predicate, ['exists', variables, body] if variables else body])
+
+        inlined = []
+        for clause in clauses:
+            if clause is rule:
+                continue
+            variables, body = list(clause.variables), []
+            for literal in clause.body:
+                found = application(literal, predicates)
+                if found is None or found[0] != predicate:
+                    body.append(literal)
+                    continue
+                added, literals = instantiate(rule, found[1], fresh)
+                variables.extend(added)
+                body.extend(literals)
+            inlined.append(Clause(variables, body, clause.head))
+        clauses = inlined
+
+def drop_arguments(clauses, predicates, projections):
+    # Arguments are checked against the current arities, so the dropped positions are mapped back
+    # to the original ones through the positions that were kept before
+    for predicate, declaration in predicates.items():
+        heads = [application(clause.head, predicates)[1] for clause in clauses
+                 if head_of(clause, predicates) == predicate]
+        occurrences = [(clause, application(literal, predicates)[1]) for clause in clauses
+                       for literal in clause.body if application(literal, predicates)
+                       and application(literal, predicates)[0] == predicate]
+        if not heads or not occurrences:
+            continue
+
+        unused, constants = set(), dict()
+        for i in range(len(declaration[2])):
+            if all(is_free(arguments[i], clause) for clause, arguments in occurrences):
+                unused.add(i)
+            elif all(is_constant(arguments[i]) for arguments in heads) \
+                    and len(set(serialize(arguments[i]) for arguments in heads)) == 1:
+                constants[i] = heads[0][i]
+        if not unused and not constants:
+            continue
+
+        dropped = unused | set(constants)
+        kept = [i for i in range(len(declaration[2])) if i not in dropped]
+        original = projections.get(predicate, {'kept': list(range(len(declaration[2]))), 'constants': []})
+        projections[predicate] = {
+            'kept': [original['kept'][i] for i in kept],
+            'constants': original['constants'] + [[original['kept'][i], c] for i, c in constants.items()],
+        }
+        predicates[predicate] = [declaration[0], declaration[1], [declaration[2][i] for i in kept], declaration[3]]
+
+        for clause in clauses:
+            if head_of(clause, predicates) == predicate:
+                arguments = application(clause.head, predicates)[1]
+                clause.head = apply(declaration[1], [arguments[i] for i in kept])
+            body = []
+            for literal in clause.body:
+                found = application(literal, predicates)
+                if found is None or found[0] != predicate:
+                    body.append(literal)
+                    continue
+                body.append(apply(declaration[1], [found[1][i] for i in kept]))
+                body.extend(['=', found[1][i], c] for i, c in constants.items())
+            clause.body = body
+        return True
+    return False
+
+def is_free(argument, clause):
+    # A variable that occurs nowhere else in the clause does not constrain anything
+    return (type(argument) is str and argument in set(name for name, _ in clause.variables)
+            and symbols([clause.body, clause.head])[argument] == 1)
+
+def is_constant(argument):
+    if type(argument) is list:
+        return len(argument) == 2 and argument[0] == '-' and is_constant(argument[1])
+    return argument in ('true', 'false') or argument.replace('.', '', 1).isdigit() or argument.startswith('#')
+
+def simplify(commands, metadata):
+    statements = list(commands)
+    predicates = {unquote(statement[1]): statement for statement in statements if is_predicate(statement)}
+
+    clauses = []
+    for statement in statements:
+        if statement[0] == 'assert':
+            clauses.append(normalize(statement[1], predicates))
+        elif not is_predicate(statement) and clause_predicates(statement, predicates):
+            clauses.append(None)
+    if None in clauses or not any(clause.head == 'false' for clause in clauses):
+        yield from statements
+        return
+
+    definitions, projections = [], dict()
+    clauses = deduplicate(clauses)
+    clauses = remove_unused(clauses, predicates, definitions)
+    clauses = inline(clauses, predicates, definitions, fresh_names())
+    while drop_arguments(clauses, predicates, projections):
+        pass
+    clauses = deduplicate(clauses)
+
+    remaining = set(head_of(clause, predicates) for clause in clauses)
+    remaining.update(predicate for clause in clauses for predicate in body_predicates(clause, predicates))
+    eliminated = set(predicate for predicate, _ in definitions)
+    definitions.extend([predicate, 'true'] for predicate in predicates
+                       if predicate not in remaining and predicate not in eliminated)
+    metadata['signatures'] = {unquote(statement[1]): [statement[1], statement[2]]
+                              for statement in statements if is_predicate(statement)}
+    metadata['definitions'] = definitions
+    metadata['projections'] = {predicate: projection for predicate, projection in projections.items()
+                               if predicate in remaining}
+
+    # The clauses take the place of the last one, which follows the declarations of all predicates they use
+    last = max(index for index, statement in enumerate(statements) if statement[0] == 'assert')
+    for index, statement in enumerate(statements):
+        if is_predicate(statement):
+            if unquote(statement[1]) in remaining:
+                yield predicates[unquote(statement[1])]
+        elif index == last:
+            yield from (['assert', clause.term()] for clause in clauses)
+        elif statement[0] != 'assert':
+            yield statement
+
+def restore(commands, metadata):
+    # Predicates with dropped arguments are extended with those arguments again, then the eliminated
+    # predicates follow in the reverse order of their elimination, so each only refers to earlier ones
+    signatures = metadata.get('signatures', dict())
+    projections = metadata.get('projections', dict())
+    for statement in commands:
+        projection = projections.get(unquote(statement[1])) if statement[0] == 'define-fun' else None
+        if projection is None:
+            yield statement
+            continue
+
+        _, name, parameters, sort, body = statement
+        bindings = [[parameter, f'x!{i}'] for (parameter, _), i in zip(parameters, projection['kept'])
+                    if parameter != f'x!{i}']
+        if bindings:
+            body = ['let', bindings, body]
+        if projection['constants']:
+            body = ['and'] + [['=', f'x!{i}', c] for i, c in projection['constants']] + [body]
+        _, sorts = signatures[unquote(name)]
+        yield ['define-fun', name, [[f'x!{i}', s] for i, s in enumerate(sorts)], sort, body]
+
+    for predicate, body in reversed(metadata.get('definitions', [])):
+        symbol, sorts = signatures[predicate]
+        yield ['define-fun', symbol, [[f'x!{i}', s] for i, s in enumerate(sorts)], 'Bool', body]
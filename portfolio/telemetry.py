@@ -0,0 +1,89 @@
+import os
+import resource
+
+from contextlib import contextmanager
+from threading import get_ident
+from time import time
+
+
+enabled = False
+process_name = 'portfolio'
+spans = []
+
+
+def enable(name='portfolio'):
+    global enabled, process_name
+
+    enabled = True
+    process_name = name
+
+def reset(name):
+    # Forked workers inherit the spans of their parent, which are reported by the parent itself
+    global process_name
+
+    process_name = name
+    spans.clear()
+
+def collect():
+    collected = list(spans)
+    spans.clear()
+    return collected
+
+def usage():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+            max(own.ru_maxrss, children.ru_maxrss) / 1024)
+
+def record(name, category, start, end, tid=None, **attributes):
+    if not enabled:
+        return
+    spans.append({
+        'name': name,
+        'category': category,
+        'process': process_name,
+        'pid': os.getpid(),
+        'tid': tid or get_ident(),
+        'start': start,
+        'duration': end - start,
+        'attributes': attributes,
+    })
+
+@contextmanager
+def span(name, category='portfolio', **attributes):
+    # CPU time and peak RSS cover this process and its reaped children, so spans of concurrent threads
+    # in the same process overlap in their usage, unless the caller sets the usage it measured itself
+    if not enabled:
+        yield attributes
+        return
+
+    start, (cpu_start, _) = time(), usage()
+    try:
+        yield attributes
+    finally:
+        cpu_end, max_rss = usage()
+        record(name, category, start, time(), **{'cpu': round(cpu_end - cpu_start, 6), 'max_rss': max_rss, **attributes})
+
+def write_trace(path):
+    import json
+
+    if path.suffix == '.jsonl':
+        with open(path, 'w') as trace_handle:
+            trace_handle.writelines(json.dumps(s, default=str) + '\n' for s in sorted(spans, key=lambda s: s['start']))
+        return
+
+    # Chrome trace format, which can be loaded in chrome://tracing or https://ui.perfetto.dev
+    events = [{'ph': 'M', 'name': 'process_name', 'pid': pid, 'args': {'name': name}}
+              for pid, name in sorted(set((s['pid'], s['process']) for s in spans))]
+    events.extend({
+        'ph': 'X',
+        'name': s['name'],
+        'cat': s['category'],
+        'pid': s['pid'],
+        'tid': s['tid'],
+        'ts': s['start'] * 1e6,
+        'dur': s['duration'] * 1e6,
+        'args': s['attributes'],
+    } for s in spans)
+    with open(path, 'w') as trace_handle:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_handle, default=str)
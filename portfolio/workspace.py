@@ -0,0 +1,146 @@
+import os
+
+from hashlib import sha256
+from itertools import count
+from pathlib import Path
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Lock
+
+
+RAM_ROOTS = ('/dev/shm', os.environ.get('XDG_RUNTIME_DIR'))
+RAM_MIN_FREE = 256 * 2**20
+
+
+def is_tmpfs(path):
+    # The file system of a path is the one of its longest mount point
+    fstype, longest = None, -1
+    try:
+        with open('/proc/mounts', 'r') as mounts_handle:
+            for line in mounts_handle:
+                fields = line.split()
+                if len(fields) > 2 and path.is_relative_to(fields[1]) and len(fields[1]) > longest:
+                    fstype, longest = fields[2], len(fields[1])
+    except OSError:
+        return False
+    return fstype == 'tmpfs'
+
+def default_root(fallback):
+    # A RAM-backed root keeps the intermediate files off slow disks, unless it is too small to be safe,
+    # like the 64 MB /dev/shm of a default container
+    for root in RAM_ROOTS:
+        if not root:
+            continue
+        root = Path(root)
+        if root.is_dir() and os.access(root, os.W_OK | os.X_OK) and is_tmpfs(root):
+            stat = os.statvfs(root)
+            if stat.f_bavail * stat.f_frsize >= RAM_MIN_FREE:
+                return root
+    return fallback
+
+def disk_usage(path):
+    # Hard links share their blocks, so every inode is only counted once
+    inodes, usage = set(), 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.lstat(os.path.join(directory, name))
+            except OSError:
+                continue
+            if stat.st_ino not in inodes:
+                inodes.add(stat.st_ino)
+                usage += stat.st_blocks * 512
+    return usage
+
+def file_suffix(path):
+    # Temporary files are named tmpXXXXXXXX followed by their suffix
+    name = Path(path).name
+    return name[name.index('.'):] if '.' in name else ''
+
+
+class Workspace:
+    # Every run owns a directory, with a subdirectory per instance that is removed as soon as the instance
+    # is finished. Stage outputs are kept in a size-bounded store keyed by the content of their input,
+    # so a stage that was already applied to identical content is hard-linked instead of run again.
+    def __init__(self, root, store_limit):
+        self.path = Path(mkdtemp(prefix=f'portfolio-{os.getpid()}-', dir=root))
+        self.store = self.path.joinpath('store')
+        self.store.mkdir()
+        self.store_limit = store_limit
+        self.store_size = 0
+        self.artifacts = dict()
+        self.digests = dict()
+        self.names = count()
+        self.peak = 0
+        self.lock = Lock()
+
+    def directory(self):
+        return Path(mkdtemp(prefix='instance-', dir=self.path))
+
+    def release(self, directory):
+        usage = self.usage()
+        rmtree(directory, ignore_errors=True)
+        return usage
+
+    def usage(self):
+        usage = disk_usage(self.path)
+        self.peak = max(self.peak, usage)
+        return usage
+
+    def close(self):
+        self.usage()
+        rmtree(self.path, ignore_errors=True)
+
+    def digest(self, path):
+        stat = os.stat(path)
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            if key in self.digests:
+                return self.digests[key]
+
+        hasher = sha256()
+        with open(path, 'rb') as file_handle:
+            for chunk in iter(lambda: file_handle.read(2**20), b''):
+                hasher.update(chunk)
+        with self.lock:
+            self.digests[key] = hasher.hexdigest()
+        return self.digests[key]
+
+    def contains(self, key):
+        with self.lock:
+            return key in self.artifacts
+
+    def lookup(self, key, directory):
+        with self.lock:
+            if key not in self.artifacts:
+                return None
+            store_path, metadata = self.artifacts.pop(key)
+            self.artifacts[key] = (store_path, metadata)
+            link_path = directory.joinpath(f'{next(self.names)}{file_suffix(store_path)}')
+        try:
+            os.link(store_path, link_path)
+        except OSError:
+            return None
+        return str(link_path), metadata
+
+    def remember(self, key, output, metadata):
+        # Only a link is added, so remembering an artifact never writes its content again
+        store_path = self.store.joinpath(f'{sha256(repr(key).encode("utf-8")).hexdigest()}{file_suffix(output)}')
+        try:
+            os.link(output, store_path)
+            size = os.stat(store_path).st_size
+        except OSError:
+            return
+
+        with self.lock:
+            self.artifacts[key] = (store_path, metadata)
+            self.store_size += size
+
+            # The least recently used artifacts are evicted first, which only drops the store's link
+            while self.store_size > self.store_limit and self.artifacts:
+                evicted, _ = self.artifacts.pop(next(iter(self.artifacts)))
+                try:
+                    self.store_size -= os.stat(evicted).st_size
+                    os.remove(evicted)
+                except OSError:
+                    pass
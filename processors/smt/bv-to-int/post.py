@@ -1,28 +1,23 @@
 #!/usr/bin/env python3
 
-import pyparsing as pp
+import json
 import sys
 
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser, FileType
+from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
 
-pp.ParserElement.enablePackrat()
+from portfolio.bitvec import restore
+from portfolio.sexp import iter_commands, serialize
 
 
-def serialize(statement):
-    if type(statement) is not list:
-        return statement
-    return f'({" ".join(serialize(e) for e in statement)})'
+def transform(commands, metadata):
+    return restore(commands, metadata)
 
 def main(args):
-    i_expr = pp.QuotedString(quoteChar='"') | pp.QuotedString(quoteChar='|', unquoteResults=False)
-    s_expr = pp.nestedExpr(opener='(', closer=')', ignoreExpr=i_expr)
-    s_expr.ignore(';' + pp.restOfLine)
-
-    parser = pp.ZeroOrMore(s_expr)
-    ast = parser.parseFile(args.input_file, parseAll=True).asList()
-
-    sys.stdout.writelines(serialize(statement) + '\n' for statement in ast)
+    metadata = json.load(args.metadata) if args.metadata else dict()
+    sys.stdout.writelines(serialize(statement) + '\n' for statement in transform(iter_commands(args.input_file), metadata))
 
 if __name__ == '__main__':
     parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
@@ -30,5 +25,8 @@ if __name__ == '__main__':
     parser.add_argument(
         'input_file', type=FileType('r'),
         help='Path to an input file (or stdin if "-")')
+    parser.add_argument(
+        '-m', '--metadata', type=FileType('r'),
+        help='Path to the rewrite metadata written by the pre-step')
 
     main(parser.parse_args())
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+import json
+import sys
+
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser, FileType
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+
+from portfolio.simplify import restore
+from portfolio.sexp import iter_commands, serialize
+
+
+def transform(commands, metadata):
+    return restore(commands, metadata)
+
+def main(args):
+    metadata = json.load(args.metadata) if args.metadata else dict()
+    sys.stdout.writelines(serialize(statement) + '\n' for statement in transform(iter_commands(args.input_file), metadata))
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument(
+        'input_file', type=FileType('r'),
+        help='Path to an input file (or stdin if "-")')
+    parser.add_argument(
+        '-m', '--metadata', type=FileType('r'),
+        help='Path to the simplification metadata written by the pre-step')
+
+    main(parser.parse_args())
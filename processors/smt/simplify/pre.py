@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+import json
+import sys
+
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser, FileType
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+
+from portfolio.simplify import simplify
+from portfolio.sexp import iter_commands, serialize
+
+
+def transform(commands, metadata):
+    return simplify(commands, metadata)
+
+def main(args):
+    metadata = dict()
+    sys.stdout.writelines(serialize(statement) + '\n' for statement in transform(iter_commands(args.input_file), metadata))
+    if args.metadata:
+        json.dump(metadata, args.metadata)
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument(
+        'input_file', type=FileType('r'),
+        help='Path to an input file (or stdin if "-")')
+    parser.add_argument(
+        '-m', '--metadata', type=FileType('w'),
+        help='Path to write the simplification metadata for the post-step to')
+
+    main(parser.parse_args())
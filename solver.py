@@ -1,113 +1,69 @@
 #!/usr/bin/env python3
 
 import logging
+import signal
 
-from copy import copy
 from importlib import import_module
-from multiprocessing import cpu_count, Process, Queue
+from os import cpu_count
 from pathlib import Path
-from subprocess import PIPE, run
 from sys import exit
 from tempfile import mkstemp as make_tempfile
 
+from portfolio import telemetry
+from portfolio.configurations import detect_configurations, engine_of, select
+from portfolio.limits import describe_budget, parse_budgets, RESOURCES
+from portfolio.preprocess import processor_path
+from portfolio.scheduler import FAILURE_STATUSES, Scheduler
+from portfolio.workspace import default_root, Workspace
+
 
 SELF_PATH = Path(__file__).resolve().parent
 TEMP_PATH = SELF_PATH.joinpath('tmp')
 
 
-def run_engine_process(engine, args, queue):
-    logger = args.logging.getLogger(f'e:{engine}')
-    logger.setLevel(args.logging.getLevelName(args.log_level))
-
-    engine_path = args.engines_path.joinpath(engine)
-    if not engine_path.is_dir():
-        logger.critical(f'Failed to locate "{engine}" engine at "{engine_path}"!')
-        queue.put((engine, 'FAIL'))
-        return
-
-    engine_path = engine_path.joinpath('runner.py')
-    if not engine_path.is_file():
-        logger.error(f'Failed to locate "{engine}" runner at "{engine_path}"!')
-        queue.put((engine, 'FAIL'))
-        return
-
-    engine_runner = import_module(f'engines.{engine}.runner')
-    try:
-        engine_runner.setup(args)
-    except Exception as e:
-        logger.error(f'Engine "{engine}" could not be setup!')
-        logger.exception(e)
-        queue.put((engine, 'FAIL'))
-        return
-
-    if hasattr(engine_runner, 'preprocess'):
-        try:
-            logger.debug(f'Preprocessing "{args.input_file}" for "{engine}" engine ...')
-            args = engine_runner.preprocess(args)
-            for processor in args.process.get(engine, []):
-                processor_path = args.processors_path.joinpath(engine_runner.FORMAT).joinpath(processor).joinpath('pre.py')
-                if not processor_path.is_file():
-                    raise FileNotFoundError(processor_path)
-
-                _, tfile_path = make_tempfile(dir=TEMP_PATH, suffix=f'.{engine}.{processor}.pre.{engine_runner.FORMAT}')
-                logger.debug(f'Additional processor: python3 {processor_path} {args.input_file}')
-                result = run(['python3', processor_path, args.input_file], stdout=PIPE, stderr=PIPE)
-                result.check_returncode()
-
-                with open(tfile_path, 'w') as tfile_handle:
-                    tfile_handle.writelines(result.stdout.decode('utf-8'))
-                args.input_file = tfile_path
-
-            logger.info(f'Input preprocessing is complete.')
-        except Exception as e:
-            logger.error(f'Exception encountered during input preprocessing:')
-            logger.exception(e)
-            queue.put((engine, 'FAIL'))
-            return
-
-    logger.debug(f'Starting solver: {engine}("{args.input_file}").')
-    try:
-        result = engine_runner.solve(args)
-        if not result:
-            queue.put((engine, 'FAIL'))
-        else:
-            queue.put((engine, result))
-            logger.debug(f'A solution was found:\n{result}')
-    except Exception as e:
-        logger.error(f'Exception encountered during solving:')
-        logger.exception(e)
-        queue.put((engine, 'FAIL'))
-
-
 def main(args):
     logger = args.logging.getLogger('portfolio')
     logger.setLevel(args.logging.getLevelName(args.log_level))
 
     logger.debug(f'Started portfolio solver with format = "{args.format}", log level = "{args.log_level}".')
 
-    _, tfile_path = make_tempfile(dir=TEMP_PATH, suffix=f'.{args.format}')
-    logger.debug(f'Cloning input from "{args.input_file.name}" to file: {tfile_path}.')
-    with open(tfile_path, 'w') as tfile_handle:
-        tfile_handle.writelines(args.input_file.readlines())
-    args.input_file = Path(tfile_path).resolve()
-    
-    engines = args.engines
+    if args.trace:
+        telemetry.enable()
+
+    logger.debug(f'Using workspace "{args.workspace.path}".')
+
+    if not args.batch:
+        _, tfile_path = make_tempfile(dir=args.temp_path, suffix=f'.{args.format}')
+        logger.debug(f'Cloning input from "{args.input_file.name}" to file: {tfile_path}.')
+        with telemetry.span('clone-input'):
+            with open(tfile_path, 'w') as tfile_handle:
+                tfile_handle.writelines(args.input_file.readlines())
+        args.input_file = Path(tfile_path).resolve()
+
+    engines = list(args.configurations)
     if args.disable_engine:
-        for engine in args.disable_engine:
-            if engine in args.engines:
+        disabled = []
+        for pattern in args.disable_engine:
+            matched = select(pattern, args.configurations)
+            if not matched:
+                logger.warning(f'Cannot disable unknown engine: "{pattern}".')
+            for engine in matched:
                 logger.debug(f'Disabled "{engine}" engine.')
-            else:
-                logger.warning(f'Cannot disable unknown engine: "{engine}".')
-        engines = [engine for engine in engines if engine not in args.disable_engine]
+            disabled.extend(matched)
+        engines = [engine for engine in engines if engine not in disabled]
     elif args.enable_engine:
         engines = []
-        for engine in args.enable_engine:
-            if engine in args.engines:
+        for pattern in args.enable_engine:
+            matched = select(pattern, args.configurations)
+            if not matched:
+                logger.warning(f'Cannot enable unknown engine: "{pattern}".')
+            for engine in matched:
                 logger.debug(f'Enabled "{engine}" engine.')
-            else:
-                logger.warning(f'Cannot enable unknown engine: "{engine}".')
-            if not engine in engines:
-                engines.append(engine)
+                if not engine in engines:
+                    engines.append(engine)
+
+    # Configurations are started by priority, and in the order they were enabled within a priority
+    engines.sort(key=args.configurations.get)
 
     processors = dict()
     if args.process:
@@ -116,51 +72,96 @@ def main(args):
             if len(split_p) != 2:
                 logger.warning(f'Ignoring invalid process flag: {p}!')
                 continue
-            if split_p[0] not in engines:
+            if not select(split_p[0], engines):
                 logger.warning(f'Ignoring process flag "{p}" for disabled engine "{split_p[0]}"')
-            if split_p[0] not in processors:
-                processors[split_p[0]] = []
-            if split_p[1] not in processors[split_p[0]]:
-                processors[split_p[0]].append(split_p[1])
-                logger.debug(f'Registered processor "{split_p[1]}" for "{split_p[0]}" engine.')
+            for engine in select(split_p[0], engines):
+                if engine not in processors:
+                    processors[engine] = []
+                if split_p[1] not in processors[engine]:
+                    processors[engine].append(split_p[1])
+                    logger.debug(f'Registered processor "{split_p[1]}" for "{engine}" engine.')
+
+    # The simplification comes first for every engine whose format has it, so they all share its output
+    if args.simplify:
+        for engine in engines:
+            if processor_path(args, import_module(f'engines.{engine_of(engine)}.runner').FORMAT, 'simplify').is_file():
+                processors[engine] = ['simplify'] + [p for p in processors.get(engine, []) if p != 'simplify']
     args.process = processors
 
+    args.budgets = parse_budgets({kind: getattr(args, f'{kind}_limit') for kind in RESOURCES},
+                                 engines, logger)
+    for engine, budget in args.budgets.items():
+        if budget:
+            logger.debug(f'Budget for "{engine}" engine: {describe_budget(budget)}.')
+
     logger.debug(f'Active engines: {", ".join([f"{e}{processors.get(e,[])}" for e in engines])}.')
 
-    if cpu_count() <= len(engines):
-        logger.warning(f'Starting {len(engines)} engine(s); have {cpu_count()} CPU(s).')
-    elif len(engines) > 0:
-        logger.info(f'Starting {len(engines)} engine(s); {cpu_count()} CPU(s).')
-    else:
+    if len(engines) < 1:
         logger.critical(f'No engines are enabled! Quitting portfolio solver.')
         exit(1)
 
-    queue = Queue()
-    workers = []
-    for engine in engines:
-        args_copy = copy(args)
-        worker = Process(target=run_engine_process, args=(engine, args_copy, queue))
-        workers.append(worker)
-        worker.start()
-
-    waiting = len(workers)
-    while waiting > 0:
-        (engine, result) = queue.get()
-        if result != 'FAIL':
-            logger.info(f'Received a solution from engine "{engine}".')
+    # The optional features are only loaded when they are enabled, to keep them out of the startup time
+    cache = None
+    if args.cache:
+        from portfolio.cache import problem_key, ResultCache
+        cache = ResultCache(args.cache, args.cache_max_size * 2**20, args.cache_max_age * 86400, logger)
+
+    history = None
+    if args.history:
+        from portfolio.history import History
+        history = History(args.history, logger)
+
+    invariants = None
+    if args.invariants and args.format != 'smt':
+        logger.warning(f'Ignoring --invariants, which needs SMT-LIB inputs.')
+    elif args.invariants:
+        from portfolio.invariants import InvariantStore
+        invariants = InvariantStore(args.invariants, args.cache_max_size * 2**20, args.cache_max_age * 86400, logger)
+
+    if args.batch:
+        logger.info(f'Solving in batch mode with {len(engines)} engine(s) on {args.jobs} CPU(s).')
+        from portfolio.batch import run_batch
+        with telemetry.span('batch'):
+            status = run_batch(args, engines, cache, history, invariants, logger)
+        exit(status)
+
+    if cache:
+        try:
+            with telemetry.span('cache-key'):
+                cache_key = problem_key(args.input_file, engines, args)
+        except Exception as e:
+            logger.warning(f'Could not compute the cache key: {e}')
+            cache = None
+
+    if cache:
+        with telemetry.span('cache-lookup'):
+            cached = cache.get(cache_key)
+        if cached:
+            logger.info(f'Found a cached solution from engine "{cached[0]}".')
+            print(cached[1])
+            exit(0)
+
+    if args.jobs < len(engines):
+        logger.info(f'Starting {len(engines)} engine(s) on {args.jobs} CPU(s); lower-ranked engines are deferred.')
+    else:
+        logger.info(f'Starting {len(engines)} engine(s); {args.jobs} CPU(s).')
+
+    # The past solutions of predicates with the same signatures are checked first, and otherwise
+    # their conjuncts that are still inductive strengthen the input of all engines
+    scheduler = Scheduler(args, logger, max(1, args.jobs), history, invariants)
+    with telemetry.span('schedule'):
+        scheduler.submit(args.input_file, engines, args)
+        for _, engine, result, _ in scheduler.run():
+            if result in FAILURE_STATUSES:
+                logger.critical(f'No engines were able to find a solution!')
+                exit(1)
             print(result)
-            break
-        else:
-            logger.warning(f'Engine "{engine}" failed with an exception!')
-            waiting -= 1
-
-    if waiting < 1:
-        logger.critical(f'No engines were able to find a solution!')
-        exit(1)
-
-    logger.debug(f'Terminating remaining engines ...')
-    for worker in workers:
-        worker.terminate()
+            if invariants and engine != 'invariants':
+                invariants.record(args.input_file, engine, result)
+            if cache:
+                with telemetry.span('cache-store'):
+                    cache.put(cache_key, engine, result)
+                logger.debug(f'Result cache statistics: {cache.stats()}')
 
     logger.debug(f'Quitting portfolio solver.')
     exit(0)
@@ -191,6 +192,9 @@ if __name__ == '__main__':
     engines = [e.name for e in engines_path.glob('*')
                if e.is_dir() and e.name != '__pycache__' ]
     logger.debug(f'Detected engines: {engines}.')
+
+    configurations = detect_configurations(engines, logger)
+    logger.debug(f'Detected configurations: {[c for c in configurations if c not in engines]}.')
     
     processors_path = SELF_PATH.joinpath('processors')
     if not processors_path.is_dir():
@@ -212,7 +216,8 @@ if __name__ == '__main__':
     
     parser = ArgumentParser(
         formatter_class=RawDescriptionHelpFormatter,
-        epilog=f'Available processors: {", ".join(processors)}\nAvailable translators: {", ".join(translators)}')
+        epilog=f'Available engines: {", ".join(configurations)}\n'
+               f'Available processors: {", ".join(processors)}\nAvailable translators: {", ".join(translators)}')
     parser.add_argument('-f', '--format',
                         type=str.lower, default='smt', choices=['smt','sygus'],
                         help='The input file format (default: %(default)s)')
@@ -223,27 +228,107 @@ if __name__ == '__main__':
 
     enable_disable_group = parser.add_mutually_exclusive_group()
     enable_disable_group.add_argument('-e', '--enable-engine',
-                                      action='append', choices=engines,
-                                      help='Enable a CHC solver engine')
+                                      action='append', metavar='ENGINE[/CONFIGURATION]',
+                                      help='Enable a CHC solver engine configuration, or those matching a pattern like "z3-spacer*"')
     enable_disable_group.add_argument('-d', '--disable-engine',
-                                      action='append', choices=engines,
-                                      help='Disable a CHC solver engine')
+                                      action='append', metavar='ENGINE[/CONFIGURATION]',
+                                      help='Disable a CHC solver engine configuration, or those matching a pattern')
+
+    parser.add_argument('-g', '--grace-period',
+                        type=float, default=1.0,
+                        help='Seconds to wait for a cancelled engine before killing it (default: %(default)s)')
+
+    budget_group = parser.add_argument_group(
+        'budgets', 'Resource limits, either for all engines: <limit>, or for those matching a pattern: <engine>:<limit>')
+    budget_group.add_argument('-t', '--time-limit',
+                              action='append', metavar='[ENGINE:]SECONDS',
+                              help='Wall-clock time limit')
+    budget_group.add_argument('-c', '--cpu-limit',
+                              action='append', metavar='[ENGINE:]SECONDS',
+                              help='CPU time limit')
+    budget_group.add_argument('-m', '--memory-limit',
+                              action='append', metavar='[ENGINE:]MB',
+                              help='Resident memory limit')
+    budget_group.add_argument('--files-limit',
+                              action='append', metavar='[ENGINE:]COUNT',
+                              help='Open file descriptors limit')
 
     parser.add_argument('-p', '--process',
                         action='append',
                         help='Tool-specific input processing: <tool>:<processor>')
+    parser.add_argument('--simplify',
+                        action='store_true',
+                        help='Remove redundant predicates, arguments and clauses before the engines start')
+    parser.add_argument('--share-hints',
+                        action='store_true',
+                        help='Let engines publish the lemmas they learn, which engines that accept hints start from'
+                             ' once they are checked to be inductive')
+    parser.add_argument('--decompose',
+                        action='store_true',
+                        help='Solve the independent parts of the input as separate problems, and merge their models')
+    parser.add_argument('--workspace',
+                        type=dir_path, metavar='DIR',
+                        help='Directory for intermediate files (default: /dev/shm if large enough, else ./tmp)')
+    parser.add_argument('--workspace-limit',
+                        type=int, default=256, metavar='MB',
+                        help='Maximum size of the preprocessing outputs kept for reuse (default: %(default)s)')
+    parser.add_argument('--trace',
+                        type=Path, metavar='FILE',
+                        help='Write timing spans of all phases to a Chrome trace file, or as JSON lines if FILE ends in .jsonl')
+
+    scheduling_group = parser.add_argument_group(
+        'scheduling', 'Engines are started in the order of their past performance on similar problems')
+    scheduling_group.add_argument('-j', '--jobs',
+                                  type=int, default=cpu_count(),
+                                  help='Number of engines to run simultaneously (default: %(default)s)')
+    scheduling_group.add_argument('--defer-limit',
+                                  type=float, default=30.0, metavar='SECONDS',
+                                  help='Seconds after which deferred engines start even without a free CPU'
+                                       ' (default: %(default)s)')
+    scheduling_group.add_argument('--history',
+                                  type=Path, metavar='FILE',
+                                  help='Database of past runs used to rank the engines (disabled if not set)')
+    scheduling_group.add_argument('--node',
+                                  action='append', dest='nodes', metavar='ADDRESS',
+                                  help='An agent that runs engines once the local CPUs are busy: HOST:PORT or unix:PATH')
+
+    batch_group = parser.add_argument_group(
+        'batch mode', 'Solve many inputs with a single portfolio, printing one JSON record per input')
+    batch_group.add_argument('-b', '--batch',
+                             action='append', metavar='SOURCE',
+                             help='A directory, a glob pattern, or a manifest file listing inputs')
+
+    cache_group = parser.add_argument_group(
+        'result cache', 'Reuse solutions of previously solved problems')
+    cache_group.add_argument('--cache',
+                             type=Path, metavar='DIR',
+                             help='Directory for the result cache (disabled if not set)')
+    cache_group.add_argument('--cache-max-size',
+                             type=int, default=256, metavar='MB',
+                             help='Maximum size of the result cache (default: %(default)s)')
+    cache_group.add_argument('--cache-max-age',
+                             type=float, default=30, metavar='DAYS',
+                             help='Maximum age of a cached result (default: %(default)s)')
+    cache_group.add_argument('--invariants',
+                             type=Path, metavar='DIR',
+                             help='Directory of past solutions by predicate signature, which are checked against'
+                                  ' the input before the engines start (disabled if not set; same size and age limits)')
 
     parser.add_argument('input_file',
-                        type=FileType('r'),
+                        type=FileType('r'), nargs='?',
                         help='Path to an input file (or <stdin> if "-")')
 
     args = parser.parse_args()
+    if (args.input_file is None) == (args.batch is None):
+        parser.error('exactly one of an input file or --batch is required')
 
     args.logging = logging
-    args.temp_path = TEMP_PATH
+    args.workspace = Workspace(args.workspace or default_root(TEMP_PATH), args.workspace_limit * 2**20)
+    args.temp_path = args.workspace.path
 
     args.engines_path = engines_path
     args.engines = engines
+    args.configurations = configurations
 
     args.processors_path = processors_path
     args.processors = processors
@@ -251,4 +336,12 @@ if __name__ == '__main__':
     args.translators_path = translators_path
     args.translators = translators
 
-    main(args)
+    # Exiting on SIGTERM unwinds the scheduler, which stops the engines, and removes the workspace
+    signal.signal(signal.SIGTERM, lambda signum, frame: exit(128 + signum))
+    try:
+        main(args)
+    finally:
+        args.workspace.close()
+        logging.getLogger('portfolio').debug(f'Workspace peak usage was {args.workspace.peak / 2**10:.0f} KB.')
+        if args.trace:
+            telemetry.write_trace(args.trace)